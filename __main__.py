@@ -1,41 +1,61 @@
 #!/usr/bin/env python
 # coding=utf-8
-import json
 import sys
+import threading
 
+from message_adapter import codec
 from message_adapter.message_adapter import MessageAdapter
+from message_adapter.session import SessionStore
 
+FRAMED_HANDSHAKE = '<FRAMED>'
+PIPELINED_HANDSHAKE = '<PIPELINED>'
 
-def callMessageAdapterFunction(functionName, allInput):
+
+def callMessageAdapterFunction(functionName, allInput, sessions=None):
     """
     CLI helper method to handle 'single command' calls to CMA 'steps'
 
     Parameters:
-    functionName(string): CMA function to run (one of loadAndUpdateRemoteEvent, loadNestedEvent
-                          and createNextEvent
+    functionName(string): CMA function to run (one of loadAndUpdateRemoteEvent, loadNestedEvent,
+                          prepare, createNextEvent and releaseSession)
     input(dict):          Dict object representing a parsed cumulus message
+    sessions(SessionStore): Store of events kept between stream commands, None outside of
+                          stream mode.   If set, loadAndUpdateRemoteEvent and prepare called
+                          with "session": true return {"session": <handle>} instead of the
+                          event, and the other commands accept "session": <handle> in place of
+                          "event".   createNextEvent and releaseSession end the session.
 
     Returns:
     result: JSON response to pass to the next event
     """
-    if 'schemas' in allInput:
-        schemas = allInput['schemas']
+    transformer = MessageAdapter(allInput.get('schemas'))
+    handle = allInput.get('session')
+    if handle and sessions is None:
+        raise LookupError('CMA sessions are only available in stream mode')
+    if handle and functionName not in ('loadAndUpdateRemoteEvent', 'prepare'):
+        event = sessions.get(handle)
     else:
-        schemas = None
-    transformer = MessageAdapter(schemas)
-    event = allInput['event']
+        event = allInput['event']
     context = allInput.get('context')
     if functionName == 'loadAndUpdateRemoteEvent':
         result = transformer.load_and_update_remote_event(event, context)
+        if handle:
+            result = {'session': sessions.create(result)}
     elif functionName == 'loadNestedEvent':
         result = transformer.load_nested_event(event, context)
+    elif functionName == 'prepare':
+        result = transformer.prepare(event, context)
+        if handle:
+            result = {'session': sessions.create(result['event']),
+                      'nested_event': result['nested_event']}
     elif functionName == 'createNextEvent':
         handlerResponse = allInput['handler_response']
-        if 'message_config' in allInput:
-            messageConfig = allInput['message_config']
-        else:
-            messageConfig = None
+        messageConfig = allInput.get('message_config')
         result = transformer.create_next_event(handlerResponse, event, messageConfig)
+        if handle:
+            sessions.release(handle)
+    elif functionName == 'releaseSession':
+        result = sessions.release(handle)
     return result
 
 
@@ -53,20 +73,34 @@ def streamCommands():
     <EOC>
 
     A single line "<EXIT>" input will cause the program to exit
+
+    If the first line sent is "<FRAMED>" the stream switches to the length-prefixed
+    protocol handled by framedStreamCommands, if it is "<PIPELINED> [workers]" it switches
+    to the concurrent protocol handled by pipelinedStreamCommands
     """
+    sessions = SessionStore()
+    first_line = sys.stdin.buffer.readline().decode('utf-8').rstrip('\n')
+    if first_line == FRAMED_HANDSHAKE:
+        framedStreamCommands(sys.stdin.buffer, sys.stdout.buffer, sessions)
+        return
+    handshake = first_line.split()
+    if handshake and handshake[0] == PIPELINED_HANDSHAKE:
+        workers = int(handshake[1]) if len(handshake) > 1 else None
+        pipelinedStreamCommands(sys.stdin.buffer, sys.stdout.buffer, sessions, workers)
+        return
 
     cont = True
     buffer = ''
     command = ''
     jsonObj = {}
+    next_line = first_line
     while cont:
-        next_line = sys.stdin.readline().rstrip('\n')
         if next_line == '<EXIT>':
             cont = False
         elif next_line == '<EOC>':
-            jsonObj = json.loads(buffer)
-            result = callMessageAdapterFunction(command, jsonObj)
-            sys.stdout.write(json.dumps(result) + "\n")
+            jsonObj = codec.loads(buffer)
+            result = callMessageAdapterFunction(command, jsonObj, sessions)
+            sys.stdout.write(codec.dumps(result) + "\n")
             sys.stdout.write('<EOC>\n')
             sys.stdout.flush()
             buffer = ''
@@ -77,11 +111,132 @@ def streamCommands():
                 sys.stderr.write(f'warning setting command to {command}\n')
             else:
                 buffer += next_line
+        if cont:
+            next_line = sys.stdin.readline().rstrip('\n')
+
+
+def readFrame(stdin):
+    """
+    Reads one frame from a binary stream.   A frame is an ASCII header line
+    "<name> [<request id>] <length>" followed by exactly <length> bytes of payload.
+    The "<EXIT>" header carries no payload.
+
+    Parameters:
+    stdin(BufferedReader): binary input stream
+
+    Returns:
+    (name, request_id, payload): the frame name, its request id (None if the header
+                                 has none) and a bytearray payload (None for "<EXIT>")
+    """
+    header = stdin.readline()
+    if not header:
+        raise EOFError('Stream closed before <EXIT> was received')
+    fields = header.decode('ascii').split()
+    if fields and fields[0] == '<EXIT>':
+        return fields[0], None, None
+    if len(fields) not in (2, 3):
+        raise ValueError(f'Invalid frame header {header!r}')
+    name, length = fields[0], int(fields[-1])
+    request_id = fields[1] if len(fields) == 3 else None
+    payload = bytearray(length)
+    if length and stdin.readinto(payload) != length:
+        raise EOFError(f'Stream closed while reading {length} byte {name} frame')
+    return name, request_id, payload
+
+
+def writeFrame(stdout, name, payload, request_id=None):
+    """
+    Writes a "<name> [<request id>] <length>" header followed by the payload bytes to a
+    binary stream
+    """
+    header = f'{name} {len(payload)}'
+    if request_id is not None:
+        header = f'{name} {request_id} {len(payload)}'
+    stdout.write(f'{header}\n'.encode('ascii'))
+    stdout.write(payload)
+    stdout.flush()
+
+
+def framedStreamCommands(stdin, stdout, sessions=None):
+    """
+    Length-prefixed variant of the stream protocol, negotiated by sending a "<FRAMED>"
+    line as the first line of a stream session.   The CMA acknowledges with a "<FRAMED>"
+    line, after which commands are sent as frames:
+
+    FunctionName <byte length>
+    <JSON bytes>
+
+    and each response is written back as a frame:
+
+    <RESULT> <byte length>
+    <JSON bytes>
+
+    A "<EXIT>" header line will cause the program to exit
+    """
+    stdout.write(f'{FRAMED_HANDSHAKE}\n'.encode('ascii'))
+    stdout.flush()
+    while True:
+        command, _, payload = readFrame(stdin)
+        if command == '<EXIT>':
+            return
+        result = callMessageAdapterFunction(command, codec.loads(payload), sessions)
+        writeFrame(stdout, '<RESULT>', codec.dumpb(result))
+
+
+def pipelinedStreamCommands(stdin, stdout, sessions=None, workers=None):
+    """
+    Concurrent variant of the framed stream protocol, negotiated by sending
+    "<PIPELINED> [workers]" as the first line of a stream session.   The CMA acknowledges
+    with a "<PIPELINED>" line, after which commands are sent as frames tagged with a
+    client chosen request id (any token without whitespace):
+
+    FunctionName <request id> <byte length>
+    <JSON bytes>
+
+    Commands are executed by a pool of worker threads, so several may be in flight at
+    once and responses may be written back in any order:
+
+    <RESULT> <request id> <byte length>
+    <JSON bytes>
+
+    A command that fails does not end the session; its error is reported as
+
+    <ERROR> <request id> <byte length>
+    {"error": <exception type>, "message": <exception message>}
+
+    A "<EXIT>" header line causes the program to exit once all in-flight commands
+    have responded
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    write_lock = threading.Lock()
+
+    def respond(command, request_id, payload):
+        try:
+            result = callMessageAdapterFunction(command, codec.loads(payload), sessions)
+            name, response = '<RESULT>', result
+        except Exception as exception:  # pylint: disable=broad-except
+            name = '<ERROR>'
+            response = {'error': type(exception).__name__, 'message': str(exception)}
+        response_bytes = codec.dumpb(response)
+        with write_lock:
+            writeFrame(stdout, name, response_bytes, request_id)
+
+    stdout.write(f'{PIPELINED_HANDSHAKE}\n'.encode('ascii'))
+    stdout.flush()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            command, request_id, payload = readFrame(stdin)
+            if command == '<EXIT>':
+                return
+            if request_id is None:
+                raise ValueError(f'{command} frame is missing a request id')
+            executor.submit(respond, command, request_id, payload)
 
 
 def singleCommand(functionName):
     """Executes a single CMA command"""
-    allInput = json.loads(input())
+    allInput = codec.loads(sys.stdin.buffer.readline())
     return callMessageAdapterFunction(functionName, allInput)
 
 
@@ -98,7 +253,7 @@ def cmaCli():
         else:
             result = singleCommand(functionName)
             if (result is not None and len(result) > 0):
-                sys.stdout.write(json.dumps(result))
+                sys.stdout.write(codec.dumps(result))
                 sys.stdout.flush()
                 exitCode = 0
 
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Benchmarks the import cost of single-command CMA invocations.
+
+Each CMA command is run in a fresh interpreter with `python -X importtime` against the
+templates example message, which needs neither S3, the Step Functions API nor schema
+validation.   For every command the median total import time is reported along with the
+heavy dependencies the command ended up importing.
+
+Usage:
+    python benchmarks/import_time.py [repeat]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['boto3', 'botocore', 'jsonschema', 'jsonpath_ng']
+
+
+def command_inputs():
+    """ Returns the CMA input for each of the three commands """
+    with open(os.path.join(ROOT, 'examples', 'messages', 'templates.input.json')) as message:
+        event = json.load(message)
+    return {
+        'loadAndUpdateRemoteEvent': {'event': event, 'context': {}},
+        'loadNestedEvent': {'event': event, 'context': {}},
+        'createNextEvent': {'event': event, 'handler_response': {'hello': 'world'},
+                            'message_config': None},
+    }
+
+
+def measure(command, cma_input, workdir):
+    """
+    Runs one command and returns (total import time in ms, set of top level modules imported)
+    """
+    env = {key: value for (key, value) in os.environ.items() if key != 'LAMBDA_TASK_ROOT'}
+    process = subprocess.run([sys.executable, '-X', 'importtime', ROOT, command],
+                             input=json.dumps(cma_input).encode('utf-8'), cwd=workdir,
+                             env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             check=False)
+    if process.returncode != 0:
+        raise RuntimeError(f'{command} failed: {process.stderr.decode("utf-8")[-2000:]}')
+    total_us = 0
+    modules = set()
+    for line in process.stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip().split('.')[0])
+        if not name.startswith('  '):
+            # top level imports, their cumulative time includes nested imports
+            total_us += int(cumulative)
+    return total_us / 1000, modules
+
+
+def main(repeat):
+    """ Prints the import time table """
+    print(f'{"command":<28}{"median import ms":>18}  heavy modules imported')
+    with tempfile.TemporaryDirectory() as workdir:
+        for command, cma_input in command_inputs().items():
+            timings = []
+            for _ in range(repeat):
+                total_ms, modules = measure(command, cma_input, workdir)
+                timings.append(total_ms)
+            heavy = ', '.join(name for name in HEAVY_MODULES if name in modules) or '-'
+            print(f'{command:<28}{statistics.median(timings):>18.1f}  {heavy}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Benchmarks the memory used to decode a large remote event.
+
+A JSON payload of granules of the requested size is decoded from a binary stream, as the
+body of the S3 object of a `replace` pointer is, by reading it whole and decoding it with
+each codec backend, and by streaming it (codec.load, needs ijson).   For each decoder the
+peak memory allocated while decoding is reported next to the memory held by the decoded
+object alone, as measured by tracemalloc, with the decoding time.
+
+Usage:
+    python benchmarks/remote_event_memory.py [size in MB]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from message_adapter import codec  # pylint: disable=wrong-import-position
+
+
+def payload(size_mb):
+    """ Returns the encoded payload, granules of 4 files each up to about size_mb MB """
+    granules = []
+    size = 0
+    index = 0
+    while size < size_mb * 1024 * 1024:
+        granule = codec.get_backend('json').dumpb({
+            'granuleId': f'MOD09GQ.A{index:07d}.h10v04.006',
+            'dataType': 'MOD09GQ',
+            'version': '006',
+            'files': [{'name': f'granule-{index}.{extension}', 'bucket': 'protected',
+                       'key': f'MOD09GQ/{index}/granule-{index}.{extension}',
+                       'size': 1024 * index, 'checksum': 'd41d8cd98f00b204e9800998ecf8427e'}
+                      for extension in ('hdf', 'hdf.met', 'jpg', 'cmr.xml')],
+        })
+        granules.append(granule)
+        size += len(granule) + 1
+        index += 1
+    return b'{"granules": [' + b','.join(granules) + b']}'
+
+
+class Body:  # pylint: disable=too-few-public-methods
+    """ A stream returning a new bytes object on every read, like an S3 object body """
+
+    def __init__(self, raw):
+        self.raw = memoryview(raw)
+        self.position = 0
+
+    def read(self, size=-1):
+        """ Returns up to size bytes, all remaining bytes without a size """
+        end = len(self.raw) if size is None or size < 0 else self.position + size
+        chunk = self.raw[self.position:end].tobytes()
+        self.position += len(chunk)
+        return chunk
+
+
+def decoders():
+    """ Returns the decoders to compare, by name """
+    def read_whole(backend):
+        return lambda stream: backend.loads(stream.read())
+    found = {}
+    for name in sorted(codec.BACKENDS):
+        try:
+            found[f'read + {name}.loads'] = read_whole(codec.get_backend(name))
+        except ImportError:
+            continue
+    try:
+        import ijson  # pylint: disable=unused-import,import-outside-toplevel
+        found['codec.load (ijson)'] = codec.load
+    except ImportError:
+        print('ijson is not installed, skipping codec.load')
+    return found
+
+
+def measure(decode, raw):
+    """ Returns (peak MB, decoded object MB, seconds) of decoding raw with decode """
+    stream = Body(raw)
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    document = decode(stream)
+    seconds = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del document
+    return peak / 2 ** 20, retained / 2 ** 20, seconds
+
+
+def main(size_mb):
+    """ Prints the memory table """
+    raw = payload(size_mb)
+    print(f'payload {len(raw) / 2 ** 20:.0f} MB')
+    print(f'{"decoder":<24}{"peak MB":>10}{"object MB":>11}{"peak/object":>13}{"seconds":>9}')
+    os.environ[codec.STREAM_MIN_SIZE_ENV_VAR] = '0'
+    for name, decode in decoders().items():
+        peak, retained, seconds = measure(decode, raw)
+        print(f'{name:<24}{peak:>10.0f}{retained:>11.0f}{peak / retained:>13.2f}{seconds:>9.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Benchmarks the validation of a large task input against its JSON schema.
+
+A payload of granules, each with several files, is validated against a granules schema by
+the uncached path used before validators were cached (read the schema file, then
+jsonschema.validate), by the cached jsonschema validator and by the cached code generated
+validator (CMA_SCHEMA_VALIDATOR=codegen, needs fastjsonschema).   The median time of one
+validation is reported for each.
+
+Usage:
+    python benchmarks/schema_validation.py [granules] [repeat]
+"""
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from message_adapter import schemas  # pylint: disable=wrong-import-position
+
+FILE_SCHEMA = {
+    'type': 'object',
+    'required': ['name', 'bucket', 'key'],
+    'properties': {
+        'name': {'type': 'string'},
+        'bucket': {'type': 'string'},
+        'key': {'type': 'string'},
+        'size': {'type': 'integer', 'minimum': 0},
+        'checksumType': {'enum': ['md5', 'sha256', 'cksum']},
+        'checksum': {'type': 'string'},
+    },
+}
+SCHEMA = {
+    '$schema': 'http://json-schema.org/draft-04/schema#',
+    'type': 'object',
+    'required': ['granules'],
+    'properties': {
+        'granules': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'required': ['granuleId', 'files'],
+                'properties': {
+                    'granuleId': {'type': 'string'},
+                    'dataType': {'type': 'string'},
+                    'version': {'type': 'string'},
+                    'files': {'type': 'array', 'items': FILE_SCHEMA},
+                },
+            },
+        },
+    },
+}
+
+
+def payload(granules):
+    """ Returns a task input with granules of 4 files each """
+    return {'granules': [{
+        'granuleId': f'MOD09GQ.A{index:07d}.h10v04.006',
+        'dataType': 'MOD09GQ',
+        'version': '006',
+        'files': [{'name': f'granule-{index}.{extension}', 'bucket': 'protected',
+                   'key': f'MOD09GQ/{index}/granule-{index}.{extension}', 'size': 1024 * index,
+                   'checksumType': 'md5', 'checksum': 'd41d8cd98f00b204e9800998ecf8427e'}
+                  for extension in ('hdf', 'hdf.met', 'jpg', 'cmr.xml')],
+    } for index in range(granules)]}
+
+
+def uncached(filepath):
+    """ Returns the validation used before validators were cached """
+    from jsonschema import validate
+
+    def validate_file(document):
+        with open(filepath, 'rb') as schema_file:
+            validate(document, json.loads(schema_file.read()))
+    return validate_file
+
+
+def median_ms(function, document, repeat):
+    """ Returns the median duration of function(document) in ms """
+    function(document)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(document)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main(granules, repeat):
+    """ Prints the validation time table """
+    document = payload(granules)
+    print(f'{granules} granules, {granules * 4} files')
+    print(f'{"validator":<28}{"median ms":>12}')
+    with tempfile.TemporaryDirectory() as folder:
+        filepath = os.path.join(folder, 'input.json')
+        with open(filepath, 'w') as schema_file:
+            json.dump(SCHEMA, schema_file)
+        validators = {
+            'uncached jsonschema': uncached(filepath),
+            'cached jsonschema': schemas.load_validator(filepath, 'jsonschema').validate,
+        }
+        try:
+            import fastjsonschema  # pylint: disable=unused-import,import-outside-toplevel
+            validators['codegen'] = schemas.load_validator(filepath, 'codegen').validate
+        except ImportError:
+            print('fastjsonschema is not installed, skipping codegen')
+        for name, validate in validators.items():
+            print(f'{name:<28}{median_ms(validate, document, repeat):>12.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 10)
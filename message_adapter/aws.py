@@ -1,7 +1,62 @@
 """ Determines the correct AWS endpoint for AWS services """
 import os
-from boto3 import resource, client
-from botocore.config import Config
+import sys
+import threading
+
+from collections import Counter
+from .retry import CircuitBreaker, RetryPolicy
+from .util import TTLCache
+
+MAX_POOL_CONNECTIONS_ENV_VAR = 'CMA_AWS_MAX_POOL_CONNECTIONS'
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+TASK_NAME_CACHE_SIZE_ENV_VAR = 'CMA_SFN_TASK_CACHE_SIZE'
+DEFAULT_TASK_NAME_CACHE_SIZE = 256
+TASK_NAME_CACHE_TTL_ENV_VAR = 'CMA_SFN_TASK_CACHE_TTL'
+DEFAULT_TASK_NAME_CACHE_TTL = 5
+HISTORY_PAGE_SIZE = 40
+EXECUTION_HISTORY_CACHE_SIZE = 32
+EXECUTION_HISTORY_CACHE_TTL = 3600
+# Step Functions retry policy, see message_adapter.retry
+SFN_RETRY_MODE_ENV_VAR = 'CMA_SFN_RETRY_MODE'
+SFN_MAX_ATTEMPTS_ENV_VAR = 'CMA_SFN_MAX_ATTEMPTS'
+SFN_RETRY_BASE_DELAY_ENV_VAR = 'CMA_SFN_RETRY_BASE_DELAY'
+SFN_RETRY_MAX_DELAY_ENV_VAR = 'CMA_SFN_RETRY_MAX_DELAY'
+SFN_DEADLINE_ENV_VAR = 'CMA_SFN_DEADLINE'
+SFN_BREAKER_THRESHOLD_ENV_VAR = 'CMA_SFN_BREAKER_THRESHOLD'
+SFN_BREAKER_RESET_ENV_VAR = 'CMA_SFN_BREAKER_RESET'
+
+# boto3's default session is not thread safe, serialize client creation for the
+# pipelined stream mode's worker threads
+_client_lock = threading.Lock()
+# Clients are created once and reused, along with their pool of open connections.
+# Clients are thread safe and shared by the process, resources are not and are kept per
+# thread.   Both are keyed by their settings, so changing the environment creates new ones
+_clients = {}
+_thread_resources = threading.local()
+_generation = 0
+# Task names found in execution histories, by (execution ARN, resource ARN, invocation id)
+_task_names = TTLCache(
+    int(os.environ.get(TASK_NAME_CACHE_SIZE_ENV_VAR, DEFAULT_TASK_NAME_CACHE_SIZE)),
+    float(os.environ.get(TASK_NAME_CACHE_TTL_ENV_VAR, DEFAULT_TASK_NAME_CACHE_TTL)))
+# ExecutionHistory indexes of the most recently looked up executions, by execution ARN
+_execution_histories = TTLCache(EXECUTION_HISTORY_CACHE_SIZE, EXECUTION_HISTORY_CACHE_TTL)
+_execution_histories_lock = threading.Lock()
+# Retries of Step Functions requests, the breaker is shared by every lookup of the process
+sfn_retry = RetryPolicy(
+    max_attempts=int(os.environ.get(SFN_MAX_ATTEMPTS_ENV_VAR, 8)),
+    base_delay=float(os.environ.get(SFN_RETRY_BASE_DELAY_ENV_VAR, 0.25)),
+    max_delay=float(os.environ.get(SFN_RETRY_MAX_DELAY_ENV_VAR, 10)),
+    deadline=float(os.environ.get(SFN_DEADLINE_ENV_VAR, 60)),
+    breaker=CircuitBreaker('Step Functions',
+                           int(os.environ.get(SFN_BREAKER_THRESHOLD_ENV_VAR, 10)),
+                           float(os.environ.get(SFN_BREAKER_RESET_ENV_VAR, 30))))
+# How the current task name was found: 'message' or 'api'
+_task_name_sources = Counter()
+_task_name_sources_lock = threading.Lock()
+# Invocations whose task name lookup was counted, by invocation id
+_counted_invocations = TTLCache(
+    int(os.environ.get(TASK_NAME_CACHE_SIZE_ENV_VAR, DEFAULT_TASK_NAME_CACHE_SIZE)),
+    float(os.environ.get(TASK_NAME_CACHE_TTL_ENV_VAR, DEFAULT_TASK_NAME_CACHE_TTL)))
 
 
 def localhost_s3_url():
@@ -13,34 +68,89 @@ def localhost_s3_url():
     return s3_url
 
 
+def _testing():
+    return ('CUMULUS_ENV' in os.environ) and (os.environ['CUMULUS_ENV'] == 'testing')
+
+
+def _max_pool_connections():
+    return int(os.environ.get(MAX_POOL_CONNECTIONS_ENV_VAR, DEFAULT_MAX_POOL_CONNECTIONS))
+
+
+def _client_config(max_pool_connections, **kwargs):
+    """ Returns the botocore configuration shared by all clients """
+    from botocore.config import Config
+
+    return Config(max_pool_connections=max_pool_connections, **kwargs)
+
+
 def s3():
-    """ Determines the endpoint for the S3 service """
+    """ Determines the endpoint for the S3 service, returns this thread's cached resource """
+    key = (localhost_s3_url() if _testing() else None, _max_pool_connections())
+    if getattr(_thread_resources, 'generation', None) != _generation:
+        _thread_resources.generation = _generation
+        _thread_resources.s3 = {}
+    if key not in _thread_resources.s3:
+        _thread_resources.s3[key] = _create_s3(*key)
+    return _thread_resources.s3[key]
 
-    if ('CUMULUS_ENV' in os.environ) and (os.environ['CUMULUS_ENV'] == 'testing'):
-        return resource(
-            service_name='s3',
-            endpoint_url=localhost_s3_url(),
-            aws_access_key_id='my-id',
-            aws_secret_access_key='my-secret',
-            region_name='us-east-1',
-            verify=False
-        )
-    return resource('s3')
+
+def _create_s3(endpoint_url, max_pool_connections):
+    from boto3 import resource
+
+    with _client_lock:
+        if endpoint_url:
+            return resource(
+                service_name='s3',
+                endpoint_url=endpoint_url,
+                aws_access_key_id='my-id',
+                aws_secret_access_key='my-secret',
+                region_name='us-east-1',
+                verify=False,
+                config=_client_config(max_pool_connections)
+            )
+        return resource('s3', config=_client_config(max_pool_connections))
 
 
 def stepFn():
     """Localstack doesn't support step functions. This method is an interim solution so we
-       don't make requests to the AWS API in testing."""
+       don't make requests to the AWS API in testing.
+       Returns the process wide cached client"""
     region = os.getenv('AWS_DEFAULT_REGION', 'us-east-1')
-    if ('CUMULUS_ENV' in os.environ) and (os.environ["CUMULUS_ENV"] == 'testing'):
-        return client(service_name='stepfunctions',
-                      endpoint_url=localhost_s3_url(), region_name=region)
+    key = (region, localhost_s3_url() if _testing() else None, _max_pool_connections())
+    client = _clients.get(key)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = _create_step_functions(*key)
+    return client
+
 
-    config = Config(region_name=region, retries=dict(max_attempts=30))
+def _create_step_functions(region, endpoint_url, max_pool_connections):
+    from boto3 import client
+
+    # requests are retried by sfn_retry, the client only rate limits them in adaptive mode
+    retries = {'mode': os.environ.get(SFN_RETRY_MODE_ENV_VAR, 'adaptive'), 'max_attempts': 0}
+    if endpoint_url:
+        return client(service_name='stepfunctions', endpoint_url=endpoint_url,
+                      region_name=region,
+                      config=_client_config(max_pool_connections, retries=retries))
+    config = _client_config(max_pool_connections, region_name=region, retries=retries)
     return client('stepfunctions', config=config)
 
 
-def get_current_sfn_task(state_machine_arn, execution_name, arn):
+def reset_clients():
+    """
+    Drops every cached client and resource, so the next ones are created with the current
+    environment.   Meant for tests
+    """
+    global _generation  # pylint: disable=global-statement
+    with _client_lock:
+        _clients.clear()
+        _generation += 1
+
+
+def get_current_sfn_task(state_machine_arn, execution_name, arn, invocation_id=None):
     """
     * Given a state machine ARN, an execution name, and an optional Activity or Lambda ARN
     * returns the most recent task name started for the given ARN in that execution,
@@ -50,19 +160,83 @@ def get_current_sfn_task(state_machine_arn, execution_name, arn):
     * execution is the desired execution. This WILL BREAK parallel executions, so always supply
     * this if possible.
     *
+    * Task names are cached for a few seconds (CMA_SFN_TASK_CACHE_TTL), so the several
+    * lookups made for one message only query the execution history once.  The same function
+    * can run consecutive steps of an execution, so only lookups with an invocation_id,
+    * which tells those apart, use the cache.  Without one (activities) the execution
+    * history is always queried.
+    *
+    * Throttled and failed requests are retried by sfn_retry within an overall deadline
+    * (CMA_SFN_DEADLINE).   After repeated failures its circuit breaker makes lookups fail
+    * fast with message_adapter.retry.CircuitOpenError, a LookupError.
+    *
     * @param {string} state_machine_arn The ARN of the state machine containing the execution
     * @param {string} execution_name The name of the step function execution to look up
     * @param {string} arn An ARN to an Activity or Lambda to find. See "IMPORTANT!"
+    * @param {string} invocation_id Optional, the request id of the current invocation
     * @returns {string} The name of the task being run
     """
-    sfn = stepFn()
     execution_arn = _get_sfn_execution_arn_by_name(state_machine_arn, execution_name)
-    execution_history = sfn.get_execution_history(
-        executionArn=execution_arn,
-        maxResults=40,
-        reverseOrder=True
-    )
-    return _get_task_name_from_execution_history(execution_history, arn)
+    key = (execution_arn, arn, invocation_id)
+    task_name = _task_names.get(key) if invocation_id is not None else None
+    if task_name is not None:
+        return task_name
+    count_task_name_source('api', invocation_id)
+    history = _get_execution_history(execution_arn)
+    with history.lock:
+        history.started = sfn_retry.timer()
+        history.refresh()
+        task_name = history.task_name(arn)
+    if invocation_id is not None:
+        _task_names.set(key, task_name)
+    return task_name
+
+
+def count_task_name_source(source, invocation_id=None):
+    """
+    * Counts how the task name of an invocation was found and reports it on stderr, along
+    * with the counts and task name cache statistics of the process, in a line such as
+    * "info task name source=api lookups api=1 message=0 cache_hits=0 cache_misses=1".
+    * An invocation looking up its task name several times, for loadAndUpdateRemoteEvent and
+    * loadNestedEvent, is counted once when its invocation_id is supplied
+    * @param {string} source 'message' when the task name was supplied by the message,
+    * 'api' when the step function execution history was queried
+    * @param {string} invocation_id Optional, the request id of the current invocation
+    """
+    if invocation_id is not None:
+        with _task_name_sources_lock:
+            if _counted_invocations.get(invocation_id) is not None:
+                return
+            _counted_invocations.set(invocation_id, source)
+    with _task_name_sources_lock:
+        _task_name_sources[source] += 1
+        counts = ' '.join(f'{name}={_task_name_sources[name]}' for name in ('api', 'message'))
+    info = task_name_cache_info()
+    sys.stderr.write(f'info task name source={source} lookups {counts} '
+                     f'cache_hits={info[0]} cache_misses={info[1]}\n')
+
+
+def task_name_source_counts():
+    """ Returns the number of current task name lookups by source, see count_task_name_source """
+    with _task_name_sources_lock:
+        return dict(_task_name_sources)
+
+
+def task_name_cache_info():
+    """ Returns the hits, misses, maxsize and currsize of the task name cache """
+    return _task_names.cache_info()
+
+
+def task_name_cache_clear():
+    """
+    Empties the task name cache, resets its statistics and the lookup counts and forgets
+    execution histories
+    """
+    _task_names.clear()
+    _execution_histories.clear()
+    with _task_name_sources_lock:
+        _task_name_sources.clear()
+        _counted_invocations.clear()
 
 
 def _get_sfn_execution_arn_by_name(state_machine_arn, execution_name):
@@ -76,42 +250,124 @@ def _get_sfn_execution_arn_by_name(state_machine_arn, execution_name):
                        execution_name])
 
 
-def _get_task_name_from_execution_history(execution_history, arn):
+def _get_execution_history(execution_arn):
+    """ Returns the ExecutionHistory index of an execution, creating it on first use """
+    with _execution_histories_lock:
+        history = _execution_histories.get(execution_arn)
+        if history is None:
+            history = ExecutionHistory(execution_arn)
+            _execution_histories.set(execution_arn, history)
+        return history
+
+
+class ExecutionHistory:
     """
-    * Given an execution history object returned by the StepFunctions API and an optional
-    * Activity or Lambda ARN returns the most recent task name started for the given ARN,
-    * or if no ARN is supplied, the most recent task started.
-    *
-    * IMPORTANT! If no ARN is supplied, this message assumes that the most recently started
-    * execution is the desired execution. This WILL BREAK parallel executions, so always supply
-    * this if possible.
-    *
-    * @param {dict} executionHistory The execution history returned by getExecutionHistory,
-    * assumed to be sorted so most recent executions come last
-    * @param {string} arn An ARN to an Activity or Lambda to find. See "IMPORTANT!"
-    * @throws If no matching task is found
-    * @returns {string} The matching task name
+    * The events of a step function execution fetched so far, newest first.   Pages of the
+    * execution history are fetched with nextToken only as far back as lookups need, and
+    * refresh() only fetches the events added since the previous lookup.   Only the fields
+    * used to identify tasks are kept.   Callers hold lock while using an instance
     """
-    events_by_id = {}
 
-    # Create a lookup table for finding events by their id
-    for event in execution_history['events']:
-        events_by_id[event['id']] = event
+    def __init__(self, execution_arn):
+        self.execution_arn = execution_arn
+        self.lock = threading.Lock()
+        self.events = []
+        self.events_by_id = {}
+        self.fetched = False
+        # when the current lookup started, its requests share one retry deadline
+        self.started = None
+        # token of the page after the oldest event fetched, None once the oldest is reached
+        self.older_token = None
+
+    def _page(self, next_token=None):
+        params = {'executionArn': self.execution_arn, 'maxResults': HISTORY_PAGE_SIZE,
+                  'reverseOrder': True}
+        if next_token:
+            params['nextToken'] = next_token
+        page = sfn_retry.call(stepFn().get_execution_history, params, self.started)
+        return [_task_event(event) for event in page['events']], page.get('nextToken')
+
+    def _add(self, events, older=True):
+        for event in events:
+            self.events_by_id[event['id']] = event
+        if older:
+            self.events.extend(events)
+        else:
+            self.events[:0] = events
+
+    def refresh(self):
+        """ Fetches the events added to the history since the last fetch """
+        if not self.fetched:
+            events, self.older_token = self._page()
+            self._add(events)
+            self.fetched = True
+            return
+        newest_id = self.events[0]['id'] if self.events else 0
+        new_events, next_token = [], None
+        while True:
+            events, next_token = self._page(next_token)
+            new_events.extend(event for event in events if event['id'] > newest_id)
+            if not next_token or any(event['id'] <= newest_id for event in events):
+                break
+        self._add(new_events, older=False)
+
+    def fetch_older(self):
+        """ Fetches the next page of older events, returns False if there are none """
+        if not self.older_token:
+            return False
+        events, self.older_token = self._page(self.older_token)
+        self._add(events)
+        return True
+
+    def newest_first(self):
+        """ Yields the events newest first, fetching older pages as they are reached """
+        index = 0
+        while index < len(self.events) or self.fetch_older():
+            yield self.events[index]
+            index += 1
+
+    def event(self, event_id):
+        """ Returns the event with the given id, fetching older pages until it is found """
+        while event_id not in self.events_by_id and self.fetch_older():
+            pass
+        return self.events_by_id.get(event_id)
+
+    def task_name(self, arn):
+        """
+        * Returns the most recent task name started for the given ARN, or if no ARN is
+        * supplied, the most recent task started.   Scans the events newest first and
+        * stops at the first one that identifies a task
+        * @param {string} arn An ARN to an Activity or Lambda to find
+        * @throws If no matching task is found
+        * @returns {string} The matching task name
+        """
+        for step in self.newest_first():
+            # Find the ARN in the history (the API is awful here).  When found, return its
+            # previousEventId's (TaskStateEntered) name
+            lambda_of_type_and_matching_arn = (
+                step['type'] in ('LambdaFunctionScheduled', 'ActivityScheduled') and
+                step['resource'] == arn)
+
+            if arn is not None and lambda_of_type_and_matching_arn:
+                previous = self.event(step['previousEventId'])
+                if previous is not None and previous['name'] is not None:
+                    return previous['name']
 
-    for step in execution_history['events']:
-        # Find the ARN in the history (the API is awful here).  When found, return its
-        # previousEventId's (TaskStateEntered) name
-        lambda_of_type_and_matching_arn = (
-            (step['type'] == 'LambdaFunctionScheduled' and
-             step['lambdaFunctionScheduledEventDetails']['resource'] == arn) or
-            (step['type'] == 'ActivityScheduled' and
-             step['activityScheduledEventDetails']['resource'] == arn))
+            if step['type'] == 'TaskStateEntered':
+                return step['name']
 
-        if (arn is not None and lambda_of_type_and_matching_arn and
-                'stateEnteredEventDetails' in events_by_id[step['previousEventId']]):
-            return events_by_id[step['previousEventId']]['stateEnteredEventDetails']['name']
+        raise LookupError(f'No task found for {arn}')
 
-        if step['type'] == 'TaskStateEntered':
-            return step['stateEnteredEventDetails']['name']
 
-    raise LookupError('No task found for ' + arn)
+def _task_event(event):
+    """ Returns the fields of an execution history event used to identify tasks """
+    details = (event.get('lambdaFunctionScheduledEventDetails') or
+               event.get('activityScheduledEventDetails') or {})
+    state_entered = event.get('stateEnteredEventDetails')
+    return {
+        'id': event['id'],
+        'previousEventId': event.get('previousEventId'),
+        'type': event['type'],
+        'resource': details.get('resource'),
+        'name': state_entered['name'] if state_entered is not None else None,
+    }
@@ -0,0 +1,245 @@
+"""
+JSON encoding and decoding for Cumulus messages.
+
+The stdlib json module is used unless the CMA_JSON_CODEC environment variable selects
+another backend: 'json' (the default), 'orjson' or 'auto', the fastest installed backend.
+Only the stdlib backend encodes documents exactly as previous releases did, which matters
+for the output of the CLI and for the size compared against ReplaceConfig.MaxSize, so
+faster backends must be opted into.
+
+Every backend must decode any document to the same Python objects as the stdlib json
+module, and encode objects to JSON that decodes back to equal objects.   Whitespace and
+escaping of the encoded text may differ between backends: orjson writes compact JSON
+without ASCII escapes.   Documents a fast backend cannot handle exactly are passed on to
+the stdlib json module: NaN and infinite floats, which orjson decodes as errors and encodes
+as null, and integers wider than 64 bits, which it decodes as floats.
+
+load() decodes a document read from a binary file-like object, such as the body of an S3
+object.   Large documents are parsed in chunks as they are read when ijson is installed, so
+that the encoded document is never held in memory next to the decoded one.
+"""
+import json
+import math
+import os
+import re
+
+CODEC_ENV_VAR = 'CMA_JSON_CODEC'
+STREAM_MIN_SIZE_ENV_VAR = 'CMA_JSON_STREAM_MIN_SIZE'
+DEFAULT_STREAM_MIN_SIZE = 8 * 1024 * 1024
+# numbers of 19 digits or more may not fit in 64 bits, the patterns also match digits in
+# strings, which are then decoded by the stdlib too
+_WIDE_NUMBER = re.compile(rb'[0-9]{19}')
+_WIDE_NUMBER_STR = re.compile(r'[0-9]{19}')
+
+
+class StreamingDecodeError(ValueError):
+    """ Raised by load() for documents the streaming parser rejects """
+
+
+class StdlibBackend:
+    """ Backend based on the stdlib json module """
+    name = 'json'
+    # whether loads() decodes bytes without first copying them into a str
+    decodes_buffers = False
+
+    @staticmethod
+    def loads(data):
+        """ Decodes a JSON document given as str, bytes, bytearray or memoryview """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        """ Encodes an object to a JSON str """
+        return json.dumps(obj)
+
+    @staticmethod
+    def dumpb(obj):
+        """ Encodes an object to UTF-8 encoded JSON bytes """
+        return json.dumps(obj).encode('utf-8')
+
+
+class OrjsonBackend:  # pylint: disable=no-member
+    """
+    Backend based on orjson, falling back to the stdlib for documents orjson cannot decode
+    or encode exactly.   orjson encodes NaN and infinite floats as null without raising, so
+    once loads() has handed a document to the stdlib, which is how such floats enter
+    decoded messages, dumpb() checks every document whose output has a null for them.
+    Documents built in Python with such floats must be encoded with the stdlib backend
+    """
+    name = 'orjson'
+    decodes_buffers = True
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._non_finite_possible = False
+
+    def _stdlib_loads(self, data):
+        self._non_finite_possible = True
+        return StdlibBackend.loads(data)
+
+    def loads(self, data):
+        """ Decodes a JSON document given as str, bytes, bytearray or memoryview """
+        wide_number = _WIDE_NUMBER_STR if isinstance(data, str) else _WIDE_NUMBER
+        if wide_number.search(data):
+            return self._stdlib_loads(data)
+        try:
+            return self._orjson.loads(data)
+        except self._orjson.JSONDecodeError:
+            return self._stdlib_loads(data)
+
+    def dumps(self, obj):
+        """ Encodes an object to a JSON str """
+        return self.dumpb(obj).decode('utf-8')
+
+    def dumpb(self, obj):
+        """ Encodes an object to UTF-8 encoded JSON bytes """
+        try:
+            encoded = self._orjson.dumps(obj)
+        except (self._orjson.JSONEncodeError, TypeError):
+            return StdlibBackend.dumpb(obj)
+        if self._non_finite_possible and b'null' in encoded and _has_non_finite_float(obj):
+            return StdlibBackend.dumpb(obj)
+        return encoded
+
+
+def _has_non_finite_float(obj):
+    """ Returns whether a document contains a NaN or infinite float """
+    pending = [obj]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+    return False
+
+
+BACKENDS = {
+    StdlibBackend.name: StdlibBackend,
+    OrjsonBackend.name: OrjsonBackend,
+}
+
+_backend = None
+
+
+def get_backend(name=None):
+    """
+    Returns a codec backend.   Without a name the backend configured by CMA_JSON_CODEC is
+    returned, for 'auto' that is the fastest installed backend.
+    """
+    name = name or os.environ.get(CODEC_ENV_VAR, StdlibBackend.name)
+    if name == 'auto':
+        for candidate in (OrjsonBackend, StdlibBackend):
+            try:
+                return candidate()
+            except ImportError:
+                continue
+    if name not in BACKENDS:
+        raise LookupError(f'Unknown JSON codec {name}, expected one of {sorted(BACKENDS)}')
+    return BACKENDS[name]()
+
+
+def _get_default_backend():
+    global _backend  # pylint: disable=global-statement
+    if _backend is None:
+        _backend = get_backend()
+    return _backend
+
+
+def reset():
+    """ Forgets the selected backend, so CMA_JSON_CODEC is read again on next use """
+    global _backend  # pylint: disable=global-statement
+    _backend = None
+
+
+def loads(data):
+    """ Decodes a JSON document given as str, bytes, bytearray or memoryview """
+    return _get_default_backend().loads(data)
+
+
+def dumps(obj):
+    """ Encodes an object to a JSON str """
+    return _get_default_backend().dumps(obj)
+
+
+def dumpb(obj):
+    """ Encodes an object to UTF-8 encoded JSON bytes """
+    return _get_default_backend().dumpb(obj)
+
+
+def decodes_buffers():
+    """ Returns whether loads() decodes bytes without first copying them into a str """
+    return _get_default_backend().decodes_buffers
+
+
+def streams(size=None):
+    """
+    Returns whether load() parses a document of size bytes, None when unknown, in chunks
+    rather than reading it whole
+    """
+    min_size = int(os.environ.get(STREAM_MIN_SIZE_ENV_VAR, DEFAULT_STREAM_MIN_SIZE))
+    if size is not None and size < min_size:
+        return False
+    try:
+        import ijson  # pylint: disable=unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def load(stream, size=None):
+    """
+    Decodes a JSON document read from a binary file-like object.   Documents of at least
+    CMA_JSON_STREAM_MIN_SIZE bytes (default 8 MiB), or of unknown size, are parsed in chunks
+    with ijson when it is installed, other documents are read whole and decoded with loads().
+    The streaming parser rejects some documents loads() accepts, such as NaN literals or
+    integers wider than 64 bits.   For those StreamingDecodeError is raised, the stream is
+    then partly consumed and the document must be decoded again, from a new stream, with
+    loads()
+    """
+    if not streams(size):
+        return loads(stream.read())
+    import ijson
+
+    try:
+        return _build(ijson.basic_parse(stream, use_float=True))
+    except ijson.JSONError as error:
+        raise StreamingDecodeError(str(error)) from error
+
+
+def _build(events):
+    """
+    Returns the document described by ijson basic_parse events.   Equal dict keys share one
+    str, as with json.loads, which keeps documents made of many similar objects much smaller
+    than the ones ijson.items() builds
+    """
+    keys = {}
+    containers = []
+    key = None
+    document = None
+    for event, value in events:
+        if event == 'map_key':
+            key = keys.setdefault(value, value)
+            continue
+        if event in ('end_map', 'end_array'):
+            containers.pop()
+            continue
+        if event == 'start_map':
+            value = {}
+        elif event == 'start_array':
+            value = []
+        if not containers:
+            document = value
+        elif isinstance(containers[-1], list):
+            containers[-1].append(value)
+        else:
+            containers[-1][key] = value
+        if event in ('start_map', 'start_array'):
+            containers.append(value)
+    return document
@@ -0,0 +1,85 @@
+"""
+Compression of the message portions stored remotely.
+
+ReplaceConfig.ContentEncoding selects how store_remote_response compresses the S3 object it
+writes: 'gzip' (stdlib) or 'zstd' (needs zstandard), at ReplaceConfig.CompressionLevel or
+the encoding's default level.   The encoding is recorded as the Content-Encoding of the S3
+object, and load_remote_event decompresses objects accordingly while they are read.
+Objects without a Content-Encoding, or with one that is not a compression, such as
+'identity', are read as they are, which is how every object was stored before.
+
+The size of the content before compression is recorded in the object's metadata, so that
+small objects can be decoded whole while large ones are decoded as they are decompressed.
+"""
+import gzip
+
+# S3 object metadata key of the uncompressed size, in bytes
+UNCOMPRESSED_LENGTH_METADATA = 'uncompressed-length'
+
+
+class Gzip:
+    """ gzip, from the stdlib """
+    name = 'gzip'
+    default_level = 6
+
+    @staticmethod
+    def compress(data, level=None):
+        """ Returns data compressed """
+        return gzip.compress(data, compresslevel=Gzip.default_level if level is None else level)
+
+    @staticmethod
+    def open(stream):
+        """ Returns a binary stream of the decompressed content of stream """
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+
+
+class Zstd:
+    """ Zstandard, based on the zstandard package """
+    name = 'zstd'
+    default_level = 3
+
+    def __init__(self):
+        import zstandard
+        self._zstandard = zstandard
+
+    def compress(self, data, level=None):
+        """ Returns data compressed """
+        level = self.default_level if level is None else level
+        return self._zstandard.ZstdCompressor(level=level).compress(data)
+
+    def open(self, stream):
+        """ Returns a binary stream of the decompressed content of stream """
+        return self._zstandard.ZstdDecompressor().stream_reader(stream)
+
+
+ENCODINGS = {
+    Gzip.name: Gzip,
+    Zstd.name: Zstd,
+}
+
+
+def get_encoding(name):
+    """
+    Returns the encoding configured by ReplaceConfig.ContentEncoding, None for no
+    compression ('identity' or no name)
+    """
+    if not name or name == 'identity':
+        return None
+    if name not in ENCODINGS:
+        raise LookupError(f'Unknown ContentEncoding {name}, expected one of '
+                          f'{sorted(ENCODINGS) + ["identity"]}')
+    return ENCODINGS[name]()
+
+
+def decoder_for(content_encoding):
+    """ Returns the encoding of an S3 object's Content-Encoding, None if not compressed """
+    return get_encoding(content_encoding) if content_encoding in ENCODINGS else None
+
+
+def uncompressed_length(data):
+    """
+    Returns the uncompressed size recorded in the metadata of an S3 GET response, None when
+    it was not recorded
+    """
+    length = (data.get('Metadata') or {}).get(UNCOMPRESSED_LENGTH_METADATA)
+    return int(length) if length and length.isdigit() else None
@@ -0,0 +1,86 @@
+"""
+Copy-on-write view of a Cumulus message.
+
+Building the next message used to deep copy the whole message, several times, so that the
+incoming message was never modified.   CopyOnWrite gives the same guarantee by copying
+only what changes: reads go to the original document, and before a container is modified
+it is made writable with writable(), which shallow copies it and every container above it
+that the view does not own yet.   Untouched subtrees, such as a large payload when only
+`meta` changes, stay shared between the original message and the result.
+
+Changes through a JSONPath that is not a simple child/index path cannot be located in
+advance, so they first deep copy the whole document, as before.
+"""
+from copy import deepcopy
+from .jsonpath import SimplePath
+
+
+class CopyOnWrite:
+    """
+    A copy-on-write view of a JSON document.   view.document is the current version of the
+    document.   With owned=True the document already belongs to the caller and is modified
+    in place
+    """
+
+    def __init__(self, document, owned=False):
+        self.document = document
+        self.owned_all = owned
+        # containers copied by this view, by id, kept referenced so ids are not reused
+        self._owned = {}
+
+    def _own(self, value):
+        """ Returns value if the view owns it, otherwise a shallow copy the view owns """
+        if self.owned_all or not isinstance(value, (dict, list)) or id(value) in self._owned:
+            return value
+        value = value.copy()
+        self._owned[id(value)] = value
+        return value
+
+    def writable(self, steps=(), create=False):
+        """
+        Returns the value at steps (dict keys and list indexes from the root), with it and
+        every container above it writable, or None if the document has no such value.
+        With create=True, keys missing from dicts along the way are added as empty dicts
+        """
+        self.document = current = self._own(self.document)
+        for step in steps:
+            if isinstance(step, int):
+                exists = isinstance(current, list) and len(current) > step
+            else:
+                exists = isinstance(current, dict) and step in current
+                if not exists and create and isinstance(current, dict):
+                    current[step] = self._own({})
+                    exists = True
+            if not exists:
+                return None
+            child = self._own(current[step])
+            if child is not current[step]:
+                current[step] = child
+            current = child
+        return current
+
+    def writable_match(self, json_path):
+        """ Returns the first match of a compiled JSONPath made writable, None if no match """
+        if isinstance(json_path, SimplePath):
+            match = self.writable(json_path.steps)
+            if match is not None:
+                return match
+        self.materialize()
+        match_data = json_path.find(self.document)
+        return match_data[0] if match_data else None
+
+    def update(self, json_path, value):
+        """ Sets every existing match of a compiled JSONPath to value """
+        if not isinstance(json_path, SimplePath):
+            self.materialize()
+        elif json_path.steps and self.writable(json_path.steps[:-1]) is None:
+            # the parent is not a plain container, jsonpath_ng decides what gets updated
+            self.materialize()
+        json_path.update(self.document, value)
+
+    def materialize(self):
+        """ Makes the whole document writable at once, with a deep copy """
+        if not self.owned_all:
+            self.document = deepcopy(self.document)
+            self.owned_all = True
+            self._owned = {}
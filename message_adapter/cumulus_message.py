@@ -1,18 +1,25 @@
-import json
-import re
 import uuid
 
-from copy import deepcopy
 from datetime import datetime, timedelta
-from jsonpath_ng import parse
-from .aws import get_current_sfn_task, s3
+from . import codec, compression
+from .aws import count_task_name_source, get_current_sfn_task, s3
+from .copy_on_write import CopyOnWrite
+from .jsonpath import compile_path
+from .template import compile_config, compile_template
+from .transfer import BufferReader, content_key, get_object, put_object, put_object_once
 
+# Key of the task name supplied by the message, e.g. with a `cma_task_name.$: $$.State.Name`
+# step function parameter in the cma block.   Prefixed, as every key of the cma block ends
+# up in the message, whose own keys must keep their meaning
+TASK_NAME_KEY = 'cma_task_name'
 
-def load_config(event, context):
+
+def load_config(event, context, sfn_task_name=None):
     """
     * Given a Cumulus message and context, returns the config object for the task
     * @param {*} event An event in the Cumulus message format with remote parts resolved
     * @param {*} context The context object passed to AWS Lambda or containing an activityArn
+    * @param {string} sfn_task_name Optional, already resolved step function task name
     * @returns {*} The task's configuration
     """
     if 'task_config' in event:
@@ -24,12 +31,34 @@ def load_config(event, context):
     if source == 'local':
         task_name = event['cumulus_meta']['task']
     elif source == 'sfn':
-        task_name = _load_step_function_task_name(event, context)
+        task_name = (sfn_task_name or message_task_name(event, _invocation_id(context)) or
+                     _load_step_function_task_name(event, context))
     else:
         raise LookupError('Unknown event source: ' + source)
     return _get_config(event, task_name) if task_name is not None else None
 
 
+def message_task_name(event, invocation_id=None):
+    """
+    * Returns the name of the current step function task if the message supplies it, which
+    * spares the step function API lookup
+    * @param {*} event An event in the Cumulus message format
+    * @param {string} invocation_id Optional, the request id of the current invocation
+    * @returns {string} The task name, or None
+    """
+    task_name = event.get(TASK_NAME_KEY)
+    if task_name is not None:
+        count_task_name_source('message', invocation_id)
+    return task_name
+
+
+def _invocation_id(context):
+    """ Returns the request id of the invocation of a Lambda or activity context, or None """
+    if not context:
+        return None
+    return context.get('aws_request_id', context.get('awsRequestId'))
+
+
 def load_remote_event(event):
     """
     * Given a Cumulus message, checks for a 'replace' key and fetches a remote stored
@@ -37,29 +66,65 @@ def load_remote_event(event):
     * @param {*} event An event in the Cumulus message format
     * @returns {*} A Cumulus message with the remote message resolved
     """
+    return load_remote_message(CopyOnWrite(event, owned=True)).document
 
+
+def load_remote_message(message):
+    """
+    * load_remote_event applied to a copy-on-write message, which is updated
+    * @param {CopyOnWrite} message A message in the Cumulus message format
+    * @returns {CopyOnWrite} message, with the remote message resolved
+    """
+    event = message.document
     if 'replace' in event:
         local_exception = event.get('exception', None)
         _s3 = s3()
-        data = _s3.Object(event['replace']['Bucket'],
-                          event['replace']['Key']).get()
+        remote_object = _s3.Object(event['replace']['Bucket'], event['replace']['Key'])
+        data = get_object(remote_object)
         target_json_path = event['replace']['TargetPath']
-        parsed_json_path = parse(target_json_path)
+        parsed_json_path = compile_path(target_json_path)
         if data is not None:
-            remote_event = json.loads(data['Body'].read().decode('utf-8'))
+            remote_event = _decode_remote_object(remote_object, data)
             replacement_targets = parsed_json_path.find(event)
             if not replacement_targets or len(replacement_targets) != 1:
                 raise Exception(f'Remote event configuration target {target_json_path} invalid')
             try:
-                replacement_targets[0].value.update(remote_event)
+                message.writable_match(parsed_json_path).update(remote_event)
             except AttributeError:
-                parsed_json_path.update(event, remote_event)
+                message.update(parsed_json_path, remote_event)
 
+            event = message.writable()
             event.pop('replace')
             exception_bool = (local_exception and local_exception != 'None')
             if exception_bool and (not event['exception'] or event['exception'] == 'None'):
                 event['exception'] = local_exception
-    return event
+    return message
+
+
+def _decode_remote_object(remote_object, data):
+    """
+    * Decodes the JSON body of an S3 object, decompressing it as it is read
+    * @param {*} remote_object The boto3 S3 Object
+    * @param {*} data The response of transfer.get_object(remote_object)
+    * @returns {*} The decoded object
+    """
+    encoding = compression.decoder_for(data.get('ContentEncoding'))
+    downloaded = isinstance(data['Body'], BufferReader)
+    if downloaded and not encoding and \
+            (codec.decodes_buffers() or not codec.streams(len(data['Body'].data))):
+        # decoding the buffer in place adds no copy of the document
+        return codec.loads(data['Body'].data)
+    if encoding:
+        # objects stored without their uncompressed size are streamed
+        body, size = encoding.open(data['Body']), compression.uncompressed_length(data)
+    else:
+        body, size = data['Body'], data.get('ContentLength')
+    try:
+        return codec.load(body, size)
+    except codec.StreamingDecodeError:
+        # the body is partly read, decode the whole object again
+        body = BufferReader(data['Body'].data) if downloaded else remote_object.get()['Body']
+        return codec.loads((encoding.open(body) if encoding else body).read())
 
 
 # Config templating
@@ -82,28 +147,8 @@ def resolve_path_str(event, json_path_string):
     * @param {*} json_path_string A string containing a JSONPath template to resolve
     * @returns {*} The resolved object
     """
-    value_regex = r"^{[^\[\]].*}$"
-    array_regex = r"^{\[.*\]}$"
-    template_regex = '{[^}]+}'
-
-    if re.search(value_regex, json_path_string):
-        match_data = parse(json_path_string.lstrip('{').rstrip('}')).find(event)
-        return match_data[0].value if match_data else None
-
-    if re.search(array_regex, json_path_string):
-        parsed_json_path = json_path_string.lstrip('{').rstrip('}').lstrip('[').rstrip(']')
-        match_data = parse(parsed_json_path).find(event)
-        return [item.value for item in match_data] if match_data else []
-
-    if re.search(template_regex, json_path_string):
-        matches = re.findall(template_regex, json_path_string)
-        for match in matches:
-            match_data = parse(match.lstrip('{').rstrip('}')).find(event)
-            if match_data:
-                json_path_string = json_path_string.replace(match, match_data[0].value)
-        return json_path_string
-
-    return json_path_string
+    template = compile_template(json_path_string)
+    return template.resolve(event) if template else json_path_string
 
 
 def resolve_input(event, config):
@@ -132,7 +177,27 @@ def resolve_config_templates(event, config):
     task_config = config.copy()
     if 'cumulus_message' in task_config:
         del task_config['cumulus_message']
-    return _resolve_config_object(event, task_config)
+    return compile_config(task_config).resolve(event, task_config)
+
+
+def resolve_config_and_input(event, config):
+    """
+    * Given a Cumulus message and its config, returns both the config object with all its
+    * JSONPath templates resolved and the input object to send to the task, as
+    * resolve_config_templates and resolve_input would.   The paths of the config and of
+    * config.cumulus_message.input are resolved together in a single traversal of the message
+    *
+    * @param {*} event The Cumulus message
+    * @param {*} config The config object
+    * @returns {*} (config object with all JSONPaths resolved, input object)
+    """
+    task_config = config.copy()
+    message_config = task_config.pop('cumulus_message', {})
+    if 'input' not in message_config:
+        return compile_config(task_config).resolve(event, task_config), event.get('payload')
+    input_template = message_config['input']
+    plan = compile_config(task_config, input_template)
+    return plan.resolve_with_input(event, task_config, input_template)
 
 
 def store_remote_response(incoming_event, default_max_size, config_keys):
@@ -144,12 +209,14 @@ def store_remote_response(incoming_event, default_max_size, config_keys):
     * @param {*} config_keys       - A list of valid CMA configuration keys
     * @returns {*} A response message, possibly referencing an S3 object for its contents
     """
-    event = deepcopy(incoming_event)
+    message = CopyOnWrite(incoming_event)
+    event = message.writable()
     replace_config = event.get('ReplaceConfig', None)
     if not replace_config:
         return event
     # Set default value if FullMessage flag set
     if replace_config.get('FullMessage', False):
+        replace_config = message.writable(['ReplaceConfig'])
         replace_config['Path'] = '$'
 
     replace_config_values = _parse_remote_config_from_event(replace_config, default_max_size)
@@ -158,31 +225,27 @@ def store_remote_response(incoming_event, default_max_size, config_keys):
         if event.get(key):
             del event[key]
 
-    cumulus_meta = deepcopy(event['cumulus_meta'])
+    cumulus_meta = event['cumulus_meta']
     replacement_data = replace_config_values['parsed_json_path'].find(event)
     if len(replacement_data) != 1:
         raise Exception(f'JSON path invalid: {replace_config_values["parsed_json_path"]}')
     replacement_data = replacement_data[0]
 
-    estimated_data_size = len(json.dumps(replacement_data.value).encode(('utf-8')))
+    body = codec.dumpb(replacement_data)
+    estimated_data_size = len(body)
 
     if estimated_data_size < replace_config_values['max_size']:
         return event
 
-    _s3 = s3()
     s3_bucket = event['cumulus_meta']['system_bucket']
-    s3_key = ('/').join(['events', str(uuid.uuid4())])
-    s3_params = {
-        'Expires': datetime.utcnow() + timedelta(days=7),  # Expire in a week
-        'Body': json.dumps(replacement_data.value)
-    }
-    _s3.Object(s3_bucket, s3_key).put(**s3_params)
+    s3_key = _upload_remote_portion(s3_bucket, body, replace_config_values)
 
     try:
-        replacement_data.value.clear()
+        message.writable_match(replace_config_values['parsed_json_path']).clear()
     except AttributeError:
-        replace_config_values['parsed_json_path'].update(event, '')
+        message.update(replace_config_values['parsed_json_path'], '')
 
+    event = message.document
     remote_configuration = {'Bucket': s3_bucket, 'Key': s3_key,
                             'TargetPath': replace_config_values['target_path']}
     event['cumulus_meta'] = event.get('cumulus_meta', cumulus_meta)
@@ -190,6 +253,35 @@ def store_remote_response(incoming_event, default_max_size, config_keys):
     return event
 
 
+def _upload_remote_portion(s3_bucket, body, replace_config_values):
+    """
+    * Writes a serialized message portion to S3, compressed and named as configured
+    * @param {string} s3_bucket The bucket to write to
+    * @param {bytes} body The serialized message portion
+    * @param {*} replace_config_values The ReplaceConfig values, see
+    *                                  _parse_remote_config_from_event
+    * @returns {string} The key of the S3 object
+    """
+    _s3 = s3()
+    s3_params = {
+        'Expires': datetime.utcnow() + timedelta(days=7),  # Expire in a week
+    }
+    encoding = replace_config_values['content_encoding']
+    if replace_config_values['content_addressed']:
+        s3_key = content_key(body, encoding.name if encoding else None)
+    else:
+        s3_key = ('/').join(['events', str(uuid.uuid4())])
+    if encoding:
+        s3_params['ContentEncoding'] = encoding.name
+        s3_params['Metadata'] = {compression.UNCOMPRESSED_LENGTH_METADATA: str(len(body))}
+        body = encoding.compress(body, replace_config_values['compression_level'])
+    if replace_config_values['content_addressed']:
+        put_object_once(_s3.Object(s3_bucket, s3_key), body, **s3_params)
+    else:
+        put_object(_s3.Object(s3_bucket, s3_key), body, **s3_params)
+    return s3_key
+
+
 def _load_step_function_task_name(event, context):
     """
     * For StepFunctions, returns the configuration corresponding to the current execution
@@ -202,7 +294,8 @@ def _load_step_function_task_name(event, context):
         arn = context['invokedFunctionArn']
     else:
         arn = context.get('invoked_function_arn', context.get('activityArn'))
-    return get_current_sfn_task(meta['state_machine'], meta['execution_name'], arn)
+    return get_current_sfn_task(meta['state_machine'], meta['execution_name'], arn,
+                                _invocation_id(context))
 
 
 def _get_config(event, task_name):
@@ -219,43 +312,17 @@ def _get_config(event, task_name):
     return config
 
 
-def _resolve_config_object(event, config):
-    """
-    * Recursive helper for resolve_config_templates
-    *
-    * Given a config object containing possible JSONPath-templated values, resolves
-    * all the values in the object using JSONPaths into the provided event.
-    *
-    * @param {*} event The event that paths resolve against
-    * @param {*} config A config object, containing paths
-    * @returns {*} A config object with all JSONPaths resolved
-    """
-
-    if isinstance(config, str):
-        return resolve_path_str(event, config)
-
-    if isinstance(config, list):
-        for i in range(0, len(config)):  # pylint: disable=consider-using-enumerate
-            config[i] = _resolve_config_object(event, config[i])
-        return config
-
-    if (config is not None and isinstance(config, dict)):
-        result = {}
-        for key in config.keys():
-            result[key] = _resolve_config_object(event, config[key])
-        return result
-
-    return config
-
-
 def _parse_remote_config_from_event(replace_config, default_max_size):
     source_path = replace_config['Path']
     target_path = replace_config.get('TargetPath', replace_config['Path'])
     default_max_size = replace_config.get('MaxSize', default_max_size)
-    parsed_json_path = parse(source_path)
+    parsed_json_path = compile_path(source_path)
 
     return {
         'target_path': target_path,
         'max_size': default_max_size,
         'parsed_json_path': parsed_json_path,
+        'content_encoding': compression.get_encoding(replace_config.get('ContentEncoding')),
+        'compression_level': replace_config.get('CompressionLevel'),
+        'content_addressed': replace_config.get('ContentAddressed', False),
     }
@@ -0,0 +1,228 @@
+"""
+On-disk cache of the remote events read from S3.
+
+Consecutive steps of a workflow, and retries of a step, often load the same `replace`
+object.   In deployments where the CMA process and its disk outlive an invocation
+(containers, activities), setting CMA_REMOTE_EVENT_CACHE_DIR keeps a copy of every object
+read, as it is stored in S3, in that directory.   The directory is bounded to
+CMA_REMOTE_EVENT_CACHE_MAX_BYTES bytes (default 256 MiB) by evicting the least recently
+used objects.
+
+A cached object is only used after a GET conditional on its ETag (If-None-Match) answers
+304 Not Modified, otherwise the new version of the object is read and cached in its place.
+Objects are written to a temporary file while they are read and renamed into place once
+complete, so that processes sharing the directory never read a partial object.   Entries
+are named after a digest of the bucket and key, the ETag and the Content-Encoding of the
+object.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from . import compression
+
+DIRECTORY_ENV_VAR = 'CMA_REMOTE_EVENT_CACHE_DIR'
+MAX_BYTES_ENV_VAR = 'CMA_REMOTE_EVENT_CACHE_MAX_BYTES'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+TEMPORARY_PREFIX = '.tmp-'
+# temporary files older than this are left over by processes that stopped
+TEMPORARY_FILE_TTL = 3600
+ETAG_PATTERN = re.compile(r'[0-9A-Za-z-]+')
+
+
+class CachedObject:
+    """ An open cached object, see DiskCache.lookup() """
+
+    def __init__(self, path, etag, content_encoding, file):
+        self.path = path
+        self.etag = etag
+        self.content_encoding = content_encoding
+        self.file = file
+        self.size = os.fstat(file.fileno()).st_size
+
+    def response(self):
+        """ Returns the cached object in the form of an S3 GET response """
+        try:
+            # marks the entry as recently used
+            os.utime(self.path)
+        except OSError:
+            pass
+        return {'Body': self.file, 'ContentLength': self.size, 'ETag': self.etag,
+                'ContentEncoding': self.content_encoding}
+
+    def close(self):
+        """ Closes the cached object when it is not used """
+        self.file.close()
+
+
+class CachingReader:
+    """ Reads a binary stream, writing what is read to a cache entry, see DiskCache.reader() """
+
+    def __init__(self, cache, stream, name, size):
+        self.cache = cache
+        self.stream = stream
+        self.name = name
+        self.size = size
+        self.written = 0
+        self._temporary = cache.temporary_file()
+
+    def read(self, size=None):
+        """ Returns up to size bytes of the stream, all remaining bytes without a size """
+        # older botocore StreamingBody.read() rejects negative sizes
+        chunk = self.stream.read() if size is None or size < 0 else self.stream.read(size)
+        if self._temporary:
+            try:
+                self._temporary.write(chunk)
+            except OSError:
+                self.discard()
+                return chunk
+            self.written += len(chunk)
+            if self.written >= self.size:
+                self.cache.commit(self._temporary, self.name)
+                self._temporary = None
+        return chunk
+
+    def discard(self):
+        """ Gives up caching the stream """
+        if self._temporary:
+            self.cache.discard(self._temporary)
+            self._temporary = None
+
+    def close(self):
+        """ Closes the stream, an entry not read whole is not cached """
+        self.discard()
+        self.stream.close()
+
+
+class DiskCache:
+    """ A directory of cached S3 objects, see module docstring """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _prefix(bucket, key):
+        return hashlib.sha256(f'{bucket}/{key}'.encode('utf-8')).hexdigest()
+
+    def _name(self, bucket, key, data):
+        """ Returns the entry name of a GET response, None if it cannot be cached """
+        etag = data.get('ETag', '').strip('"')
+        if not ETAG_PATTERN.fullmatch(etag):
+            return None
+        encoding = compression.decoder_for(data.get('ContentEncoding'))
+        return f'{self._prefix(bucket, key)}.{etag}.{encoding.name if encoding else "identity"}'
+
+    def _entries(self, prefix=''):
+        """ Yields the os.DirEntry of every cached object starting with prefix """
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(prefix) and not entry.name.startswith('.'):
+                    yield entry
+
+    def lookup(self, bucket, key):
+        """ Returns the open CachedObject of an S3 object, None if it is not cached """
+        for entry in self._entries(self._prefix(bucket, key) + '.'):
+            _, etag, encoding = entry.name.split('.')
+            try:
+                # closed by the CachedObject
+                cached_file = open(entry.path, 'rb')  # pylint: disable=consider-using-with
+            except OSError:
+                # evicted by another process
+                continue
+            return CachedObject(entry.path, f'"{etag}"', None if encoding == 'identity'
+                                else encoding, cached_file)
+        return None
+
+    def reader(self, bucket, key, data):
+        """
+        Returns a stream of the Body of a GET response that caches the object once it is
+        read whole, or the Body itself if the object cannot be cached
+        """
+        name = self._name(bucket, key, data)
+        size = data.get('ContentLength')
+        if not name or size is None or size > self.max_bytes:
+            return data['Body']
+        return CachingReader(self, data['Body'], name, size)
+
+    def store(self, bucket, key, data, body):
+        """ Caches the object of a GET response, read whole into body """
+        name = self._name(bucket, key, data)
+        temporary = self.temporary_file() if name and len(body) <= self.max_bytes else None
+        if temporary:
+            try:
+                temporary.write(body)
+            except OSError:
+                self.discard(temporary)
+                return
+            self.commit(temporary, name)
+
+    def temporary_file(self):
+        """ Returns a new temporary file in the cache directory, None if it cannot be made """
+        try:
+            return tempfile.NamedTemporaryFile(prefix=TEMPORARY_PREFIX, dir=self.directory,
+                                               delete=False)
+        except OSError:
+            return None
+
+    def commit(self, temporary, name):
+        """ Moves a complete temporary file into place as the entry name """
+        try:
+            temporary.close()
+            os.replace(temporary.name, os.path.join(self.directory, name))
+        except OSError:
+            self.discard(temporary)
+            return
+        prefix = name.rsplit('.', 2)[0]
+        for entry in self._entries(prefix + '.'):
+            if entry.name != name:
+                # an older version of the object
+                _remove(entry.path)
+        self.evict()
+
+    @staticmethod
+    def discard(temporary):
+        """ Removes a temporary file """
+        temporary.close()
+        _remove(temporary.name)
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits in max_bytes """
+        entries = []
+        total = 0
+        now = time.time()
+        with os.scandir(self.directory) as scanned:
+            for entry in scanned:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.startswith(TEMPORARY_PREFIX):
+                    if stat.st_mtime < now - TEMPORARY_FILE_TTL:
+                        _remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_cache():
+    """ Returns the DiskCache configured by CMA_REMOTE_EVENT_CACHE_DIR, None if not set """
+    directory = os.environ.get(DIRECTORY_ENV_VAR)
+    if not directory:
+        return None
+    return DiskCache(directory, int(os.environ.get(MAX_BYTES_ENV_VAR, DEFAULT_MAX_BYTES)))
@@ -0,0 +1,197 @@
+"""
+Process wide cache of compiled JSONPath expressions.
+
+Compiling a path with jsonpath_ng runs its PLY based parser, which costs far more than
+evaluating the compiled expression.   Messages use the same few paths over and over, so
+every module compiles paths through compile_path(), which keeps the most recently used
+expressions.   The cache size is set with the CMA_JSONPATH_CACHE_SIZE environment variable.
+
+Most paths in Cumulus messages are simple child and index paths such as
+`$.meta.collection` or `$.payload.granules[0]`.   compile_path() recognizes those and
+resolves them with plain dict and list lookups (SimplePath).   Any other path, and any
+simple path applied to data jsonpath_ng treats in a non obvious way, is handled by
+jsonpath_ng (ExpressionPath).   Both return the matched values themselves rather than
+jsonpath_ng's DatumInContext objects.
+
+Paths that are resolved against the same message, such as every template of a task
+configuration, can be grouped in a PathSet, which resolves them all in one traversal.
+"""
+import os
+import re
+
+from functools import lru_cache
+
+CACHE_SIZE_ENV_VAR = 'CMA_JSONPATH_CACHE_SIZE'
+DEFAULT_CACHE_SIZE = 512
+
+# plain identifiers, a subset of what jsonpath_ng lexes as one.   `where` is a reserved word
+_ID = r'[a-zA-Z_][a-zA-Z0-9_]*'
+_SIMPLE_PATH_REGEX = re.compile(rf'(\$|{_ID})((?:\.{_ID}|\[\d+\])*)')
+_STEP_REGEX = re.compile(rf'\.({_ID})|\[(\d+)\]')
+_RESERVED_WORDS = {'where'}
+
+
+@lru_cache(maxsize=int(os.environ.get(CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_SIZE)))
+def parse(json_path):
+    """
+    Returns the compiled jsonpath_ng expression for a JSONPath string.   Compiled
+    expressions are not modified by find/update, so they are shared between callers.
+    """
+    from jsonpath_ng import parse as jsonpath_ng_parse
+    return jsonpath_ng_parse(json_path)
+
+
+class ExpressionPath:
+    """ A JSONPath evaluated by jsonpath_ng """
+
+    def __init__(self, json_path):
+        self.json_path = json_path
+        self.expression = parse(json_path)
+
+    def find(self, data):
+        """ Returns the list of values matching the path """
+        return [match.value for match in self.expression.find(data)]
+
+    def update(self, data, value):
+        """ Sets every existing match of the path to value, in place """
+        self.expression.update(data, value)
+
+    def __str__(self):
+        return str(self.expression)
+
+
+class SimplePath:
+    """
+    A JSONPath made only of field names and non-negative indexes, evaluated with direct
+    dict and list lookups.   Follows jsonpath_ng semantics: a field only matches a key of a
+    dict and an index only matches an existing element of a list.   An index applied to
+    anything but a list defers to jsonpath_ng.
+    """
+
+    def __init__(self, json_path, rooted, steps):
+        self.json_path = json_path
+        self.rooted = rooted
+        self.steps = steps
+
+    def find(self, data):
+        """ Returns the list of values matching the path (at most one) """
+        current = data
+        for step in self.steps:
+            if isinstance(step, int):
+                if not isinstance(current, list):
+                    return ExpressionPath(self.json_path).find(data)
+                if len(current) <= step:
+                    return []
+                current = current[step]
+            elif isinstance(current, dict) and step in current:
+                current = current[step]
+            else:
+                return []
+        return [current]
+
+    def update(self, data, value):
+        """ Sets the value at the path, in place, if the path already exists """
+        if not self.steps:
+            # updating the root yields the value without modifying data
+            return
+        last = self.steps[-1]
+        container_type = list if isinstance(last, int) else dict
+        parents = SimplePath(self.json_path, self.rooted, self.steps[:-1]).find(data)
+        for parent in parents:
+            if callable(value) or not isinstance(parent, container_type):
+                ExpressionPath(self.json_path).update(data, value)
+                return
+            if isinstance(last, int):
+                if len(parent) > last:
+                    parent[last] = value
+            elif last in parent:
+                parent[last] = value
+
+    def __str__(self):
+        # same rendering as jsonpath_ng's Child/Fields/Index expressions
+        steps = [f'[{step}]' if isinstance(step, int) else step for step in self.steps]
+        return '.'.join((['$'] if self.rooted else []) + steps)
+
+
+def _compile_simple_path(json_path):
+    """ Returns a SimplePath for a simple child/index path, None for any other path """
+    match = _SIMPLE_PATH_REGEX.fullmatch(json_path)
+    if not match:
+        return None
+    head, tail = match.groups()
+    steps = [] if head == '$' else [head]
+    for field, index in _STEP_REGEX.findall(tail):
+        steps.append(field if field else int(index))
+    if _RESERVED_WORDS.intersection(step for step in steps if isinstance(step, str)):
+        return None
+    return SimplePath(json_path, head == '$', steps)
+
+
+@lru_cache(maxsize=int(os.environ.get(CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_SIZE)))
+def compile_path(json_path):
+    """
+    Returns the compiled form of a JSONPath string, a SimplePath when the path allows it,
+    otherwise an ExpressionPath.   Both provide find(data) -> list of matched values and
+    update(data, value).
+    """
+    return _compile_simple_path(json_path) or ExpressionPath(json_path)
+
+
+def cache_info():
+    """ Returns the hits, misses, maxsize and currsize of the compiled path cache """
+    return compile_path.cache_info()
+
+
+def cache_clear():
+    """ Empties the compiled path and expression caches and resets their statistics """
+    compile_path.cache_clear()
+    parse.cache_clear()
+
+
+class PathSet:  # pylint: disable=too-few-public-methods
+    """
+    A set of compiled paths resolved together.   The simple paths are merged into a trie of
+    their steps, so find() walks each shared prefix, such as `$.meta`, once for all of them
+    however many paths start with it.   Other paths are evaluated one by one.
+    """
+
+    def __init__(self, paths):
+        self.trie = ({}, [])
+        self.expressions = []
+        for path in dict.fromkeys(paths):
+            if isinstance(path, SimplePath):
+                children, leaves = self.trie
+                for step in path.steps:
+                    children, leaves = children.setdefault(step, ({}, []))
+                leaves.append(path)
+            else:
+                self.expressions.append(path)
+
+    def find(self, data):
+        """
+        Returns a dict mapping each path to the list of values it matches in data, as
+        path.find(data) would.   Paths that match nothing may be missing from the dict
+        """
+        found = {path: path.find(data) for path in self.expressions}
+        stack = [(self.trie, data)]
+        while stack:
+            (children, leaves), current = stack.pop()
+            for path in leaves:
+                found[path] = [current]
+            for step, child in children.items():
+                if isinstance(step, int):
+                    if not isinstance(current, list):
+                        # jsonpath_ng decides what an index means for anything but a list
+                        for path in _trie_paths(child):
+                            found[path] = path.find(data)
+                    elif len(current) > step:
+                        stack.append((child, current[step]))
+                elif isinstance(current, dict) and step in current:
+                    stack.append((child, current[step]))
+        return found
+
+
+def _trie_paths(node):
+    """ Returns every path stored in a PathSet trie node and below it """
+    children, leaves = node
+    return leaves + [path for child in children.values() for path in _trie_paths(child)]
@@ -1,14 +1,12 @@
 import os
-import json
 
-from copy import deepcopy
-from jsonschema import validate
 from .aws import get_current_sfn_task
+from .copy_on_write import CopyOnWrite
 
-from .util import assign_json_path_value
-from .cumulus_message import (resolve_config_templates, resolve_input,
-                              resolve_path_str, load_config, load_remote_event,
-                              store_remote_response)
+from .outputs import compile_outputs
+from .schemas import load_validator, schema_exists
+from .cumulus_message import (TASK_NAME_KEY, resolve_config_and_input, load_config,
+                              load_remote_message, message_task_name, store_remote_response)
 
 
 class MessageAdapter:
@@ -16,7 +14,7 @@ class MessageAdapter:
     transforms the cumulus message
     """
     REMOTE_DEFAULT_MAX_SIZE = 0
-    CMA_CONFIG_KEYS = ['ReplaceConfig', 'task_config']
+    CMA_CONFIG_KEYS = ['ReplaceConfig', 'task_config', TASK_NAME_KEY]
 
     def __init__(self, schemas=None):
         self.schemas = schemas
@@ -44,15 +42,22 @@ class MessageAdapter:
         * @param {*} event The input Lambda event in the Cumulus message protocol
         * @returns {*} the full event data
         """
-        event = deepcopy(incoming_event)
+        return self.__load_and_update_remote_event(incoming_event, context)[0]
+
+    def __load_and_update_remote_event(self, incoming_event, context):
+        """
+        * load_and_update_remote_event implementation, also returns the current step function
+        * task name if it had to be looked up (None otherwise) so it can be reused
+        """
+        task_name = None
 
         if incoming_event.get('cma'):
-            cma_event = deepcopy(incoming_event)
-            event = load_remote_event(event['cma'].get('event'))
-            cma_event['cma']['event'].update(event)
-            event = self.__parse_parameter_configuration(cma_event)
+            event = load_remote_message(CopyOnWrite(incoming_event['cma'].get('event'))).document
+            cma_event = CopyOnWrite(incoming_event)
+            cma_event.writable(['cma', 'event']).update(event)
+            event = self.__parse_parameter_configuration(cma_event.document)
         else:
-            event = load_remote_event(event)
+            event = load_remote_message(CopyOnWrite(incoming_event)).document
 
         if context and 'meta' in event and 'workflow_tasks' in event['meta']:
             cumulus_meta = event['cumulus_meta']
@@ -62,11 +67,14 @@ class MessageAdapter:
             task_meta['arn'] = context.get('invoked_function_arn',
                                            context.get('invokedFunctionArn',
                                                        context.get('activityArn')))
-            task_name = get_current_sfn_task(cumulus_meta['state_machine'],
-                                             cumulus_meta['execution_name'],
-                                             task_meta['arn'])
-            event['meta']['workflow_tasks'][task_name] = task_meta
-        return event
+            invocation_id = context.get('aws_request_id', context.get('awsRequestId'))
+            task_name = message_task_name(event, invocation_id) or get_current_sfn_task(
+                cumulus_meta['state_machine'], cumulus_meta['execution_name'], task_meta['arn'],
+                invocation_id)
+            message = CopyOnWrite(event)
+            message.writable(['meta', 'workflow_tasks'])[task_name] = task_meta
+            event = message.document
+        return event, task_name
 
     def __get_jsonschema(self, schema_type):
         schemas = self.schemas
@@ -74,7 +82,7 @@ class MessageAdapter:
         has_schema = schemas and schemas.get(schema_type)
         rel_filepath = schemas.get(schema_type) if has_schema else f'schemas/{schema_type}.json'
         filepath = os.path.join(root_dir, rel_filepath)
-        return filepath if os.path.exists(filepath) else None
+        return filepath if schema_exists(filepath) else None
 
     def __validate_json(self, document, schema_type):
         """
@@ -82,9 +90,9 @@ class MessageAdapter:
         """
         schema_filepath = self.__get_jsonschema(schema_type)
         if schema_filepath:
-            schema = json.load(open(schema_filepath))
+            validator = load_validator(schema_filepath)
             try:
-                validate(document, schema)
+                validator.validate(document)
             except Exception as exception:
                 exception.message = f'{schema_type} schema: {str(exception)}'
                 raise exception
@@ -96,9 +104,15 @@ class MessageAdapter:
         * @param {*} event The input message sent to the Lambda
         * @returns {*} message that is ready to pass to an inner task
         """
-        config = load_config(event, context)
-        final_config = resolve_config_templates(event, config)
-        final_payload = resolve_input(event, config)
+        return self.__load_nested_event(event, context)
+
+    def __load_nested_event(self, event, context, sfn_task_name=None):
+        """
+        * load_nested_event implementation, sfn_task_name is an already resolved step
+        * function task name that spares another lookup
+        """
+        config = load_config(event, context, sfn_task_name)
+        final_config, final_payload = resolve_config_and_input(event, config)
         response = {'input': final_payload}
         self.__validate_json(final_payload, 'input')
         self.__validate_json(final_config, 'config')
@@ -126,6 +140,21 @@ class MessageAdapter:
 
         return response
 
+    def prepare(self, incoming_event, context):
+        """
+        * Combines load_and_update_remote_event and load_nested_event in a single call.
+        * The step function task name is looked up at most once and the resolved event is
+        * handed to the nested event step as is
+        *
+        * @param {*} incoming_event The input Lambda event in the Cumulus message protocol
+        * @param {*} context The context object passed to AWS Lambda or containing an activityArn
+        * @returns {*} {'event': the full event data,
+        *               'nested_event': the message that is ready to pass to an inner task}
+        """
+        event, task_name = self.__load_and_update_remote_event(incoming_event, context)
+        nested_event = self.__load_nested_event(event, context, task_name)
+        return {'event': event, 'nested_event': nested_event}
+
     @staticmethod
     def __assign_outputs(handler_response, event, message_config):
         """
@@ -136,20 +165,14 @@ class MessageAdapter:
         * @param {*} messageConfig The cumulus_message configuration
         * @returns {*} The output message with the nested response applied
         """
-        result = deepcopy(event)
+        result = CopyOnWrite(event)
         if message_config is not None and 'outputs' in message_config:
-            outputs = message_config['outputs']
-            result['payload'] = {}
-            for output in outputs:
-                source_path = output['source']
-                dest_path = output['destination']
-                dest_json_path = dest_path.lstrip('{').rstrip('}')
-                value = resolve_path_str(handler_response, source_path)
-                result = assign_json_path_value(result, dest_json_path, value)
+            result.writable()['payload'] = {}
+            compile_outputs(message_config['outputs']).apply(result, handler_response)
         else:
-            result['payload'] = handler_response
+            result.writable()['payload'] = handler_response
 
-        return result
+        return result.document
 
     def create_next_event(self, handler_response, event, message_config):
         """
@@ -167,4 +190,7 @@ class MessageAdapter:
             result['exception'] = 'None'
         if 'replace' in result:
             del result['replace']
+        if TASK_NAME_KEY in result:
+            # the next task supplies its own name
+            del result[TASK_NAME_KEY]
         return store_remote_response(result, self.REMOTE_DEFAULT_MAX_SIZE, self.CMA_CONFIG_KEYS)
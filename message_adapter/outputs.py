@@ -0,0 +1,114 @@
+"""
+Compiled cumulus_message.outputs.
+
+compile_outputs() turns the outputs of a task configuration into an OutputPlan, cached by
+a fingerprint of the outputs.   The plan resolves every source against the task's response
+in one traversal, then writes every destination into a single copy-on-write view of the
+message, creating missing keys on the way.   Assigning outputs one at a time used to copy
+the message and parse the destination path for each of them.
+
+Outputs are applied in order, so when a destination is the same path as, or lies inside,
+another destination, the result depends on the order of the outputs.   Such conflicts are
+found when the outputs are compiled and reported on stderr.
+"""
+import json
+import os
+import sys
+
+from functools import lru_cache
+from .jsonpath import PathSet, SimplePath, compile_path
+from .template import CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_SIZE, compile_template
+from .util import assign_json_path
+
+
+class Output:
+    """ One output: a source template and the destination it is written to """
+
+    def __init__(self, source, destination):
+        self.source = source
+        self.template = compile_template(source)
+        self.destination = destination.lstrip('{').rstrip('}')
+        json_path = compile_path(self.destination)
+        # plain dict keys can be written, and created, in one walk of the message
+        self.steps = None
+        if isinstance(json_path, SimplePath) and \
+                all(isinstance(step, str) for step in json_path.steps):
+            self.steps = json_path.steps
+
+    def resolve(self, handler_response, found):
+        """ Returns the value of the source in the task's response """
+        return self.template.resolve(handler_response, found) if self.template else self.source
+
+    def assign(self, message, value):
+        """ Writes value at the destination of a copy-on-write message """
+        if self.steps == []:
+            # the message root cannot be replaced
+            return
+        if self.steps is not None:
+            parent = message.writable(self.steps[:-1], create=True)
+            if isinstance(parent, dict):
+                parent[self.steps[-1]] = value
+                return
+        assign_json_path(message, self.destination, value)
+
+
+class OutputPlan:  # pylint: disable=too-few-public-methods
+    """ The compiled form of a cumulus_message.outputs list """
+
+    def __init__(self, outputs):
+        self.outputs = [Output(output['source'], output['destination']) for output in outputs]
+        paths = [path for output in self.outputs if output.template
+                 for path in output.template.paths]
+        self.path_set = PathSet(paths) if paths else None
+        self.conflicts = _find_conflicts(self.outputs)
+
+    def apply(self, message, handler_response):
+        """ Writes every output of handler_response into a copy-on-write message, in order """
+        found = self.path_set.find(handler_response) if self.path_set else None
+        values = [output.resolve(handler_response, found) for output in self.outputs]
+        for output, value in zip(self.outputs, values):
+            output.assign(message, value)
+
+
+def _find_conflicts(outputs):
+    """
+    Returns the (destination, destination) pairs where the second destination is the same
+    as, or lies inside, the first.   Only destinations made of plain keys are compared
+    """
+    conflicts = []
+    for index, output in enumerate(outputs):
+        for other in outputs[index + 1:]:
+            if not output.steps or not other.steps:
+                continue
+            shortest = min(len(output.steps), len(other.steps))
+            if output.steps[:shortest] == other.steps[:shortest]:
+                first, second = sorted((output, other), key=lambda item: len(item.steps))
+                conflicts.append((first.destination, second.destination))
+    return conflicts
+
+
+@lru_cache(maxsize=int(os.environ.get(CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_SIZE)))
+def _compile_fingerprint(fingerprint):
+    plan = OutputPlan(json.loads(fingerprint))
+    for destination, inner_destination in plan.conflicts:
+        sys.stderr.write(f'warning cumulus_message.outputs destination {inner_destination} '
+                         f'overlaps {destination}, outputs are applied in order\n')
+    return plan
+
+
+def compile_outputs(outputs):
+    """
+    Returns the OutputPlan of a cumulus_message.outputs list.   Call
+    plan.apply(message, handler_response) to write the outputs into a CopyOnWrite message
+    """
+    return _compile_fingerprint(json.dumps(outputs, sort_keys=True))
+
+
+def cache_info():
+    """ Returns the hits, misses, maxsize and currsize of the outputs plan cache """
+    return _compile_fingerprint.cache_info()
+
+
+def cache_clear():
+    """ Empties the outputs plan cache """
+    _compile_fingerprint.cache_clear()
@@ -0,0 +1,142 @@
+"""
+Retries with jittered exponential backoff, an overall deadline and a circuit breaker.
+
+RetryPolicy.call() retries throttling and transient errors, sleeping a random delay of up
+to base_delay * 2 ** attempt (capped at max_delay) between attempts, and gives up once
+max_attempts is reached or the next attempt would start after the deadline.   Other
+errors are raised at once.
+
+A CircuitBreaker shared by every call counts consecutive retryable failures.   Once
+failure_threshold is reached the circuit opens and calls fail fast with CircuitOpenError,
+without reaching the service, until reset_timeout has passed.   The next call is then let
+through: its success closes the circuit, its failure opens it again.
+
+Errors are classified by duck typing, so botocore does not need to be imported: an error
+with a botocore style `response` is retryable for throttling error codes and 5xx status
+codes, any other error when its class, or one of its base classes, is a connection or
+timeout error.
+"""
+import random
+import threading
+import time
+
+THROTTLING_ERROR_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException',
+    'RequestLimitExceeded', 'RequestThrottled', 'RequestThrottledException',
+    'ProvisionedThroughputExceededException', 'SlowDown', 'ServiceUnavailable',
+}
+TRANSIENT_ERROR_NAMES = {
+    'ConnectionError', 'EndpointConnectionError', 'ConnectionClosedError', 'ReadTimeoutError',
+    'ConnectTimeoutError', 'TimeoutError',
+}
+
+
+class CircuitOpenError(LookupError):
+    """ Raised instead of calling a service while its circuit breaker is open """
+
+
+def is_retryable(error):
+    """ Returns whether an error is a throttling or transient error worth retrying """
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        code = response.get('Error', {}).get('Code')
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return code in THROTTLING_ERROR_CODES or status >= 500
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+class CircuitBreaker:  # pylint: disable=too-many-instance-attributes
+    """ Fails calls fast after failure_threshold consecutive failures, see module docstring """
+
+    def __init__(self, name, failure_threshold, reset_timeout, timer=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timer = timer
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """ Raises CircuitOpenError if the circuit is open """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - self.timer()
+            if remaining <= 0:
+                # half open, let this call through, its result closes or reopens the circuit
+                self.opened_at = None
+                self.failures = self.failure_threshold - 1
+                return
+            raise CircuitOpenError(
+                f'{self.name} circuit breaker is open after {self.failures} consecutive '
+                f'errors, failing fast for {remaining:.1f} more seconds. '
+                f'Last error: {self.last_error!r}')
+
+    def is_open(self):
+        """ Returns whether calls currently fail fast """
+        with self._lock:
+            return self.opened_at is not None and \
+                self.timer() < self.opened_at + self.reset_timeout
+
+    def record_success(self):
+        """ Closes the circuit """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self, error):
+        """ Counts a failure, opens the circuit once failure_threshold is reached """
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            if self.failures >= self.failure_threshold:
+                self.opened_at = self.timer()
+
+
+class RetryPolicy:
+    """ Calls a function with retries, see module docstring """
+
+    def __init__(self, max_attempts, base_delay, max_delay, deadline, breaker=None,
+                 sleep=time.sleep, timer=time.monotonic):
+        # pylint: disable=too-many-arguments
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.breaker = breaker
+        self.sleep = sleep
+        self.timer = timer
+
+    def backoff(self, attempt):
+        """ Returns the delay before the retry following attempt (1 based), full jitter """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, function, kwargs=None, started=None):
+        """
+        Returns function(**kwargs), retrying retryable errors.   The deadline counts from
+        started, a value of self.timer(), which lets several calls share one deadline
+        """
+        started = self.timer() if started is None else started
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.breaker:
+                self.breaker.before_call()
+            try:
+                result = function(**(kwargs or {}))
+            except Exception as error:  # pylint: disable=broad-except
+                if not is_retryable(error):
+                    raise
+                if self.breaker:
+                    self.breaker.record_failure(error)
+                delay = self.backoff(attempt)
+                if attempt >= self.max_attempts or (self.breaker and self.breaker.is_open()) or \
+                        self.timer() + delay - started > self.deadline:
+                    raise
+                self.sleep(delay)
+                continue
+            if self.breaker:
+                self.breaker.record_success()
+            return result
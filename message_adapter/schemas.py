@@ -0,0 +1,195 @@
+"""
+Cached JSON Schema validators.
+
+Every message used to read and parse its schema files, and jsonschema.validate() checks the
+schema and builds a new validator on every call.   load_validator() keeps a ready validator
+per schema file, keyed by its real path and modification time so that an edited schema is
+picked up, and schema_exists() remembers which schema files exist.   Documents that fail
+validation are validated again with jsonschema.validate(), so the errors raised are exactly
+the ones it raises.
+
+The CMA_SCHEMA_VALIDATOR environment variable selects how valid documents are recognised:
+'jsonschema' (the default) uses the jsonschema validator, 'codegen' uses a Python function
+generated from the schema by fastjsonschema, which must then be installed.   The generated
+code is cached next to the schema file, in a hidden file named after the schema and a
+digest of its content, when that directory is writable.   A cached file is only executed
+when it starts with the digest of the code that follows, and is owned by the user running
+the CMA and not writable by others, otherwise the code is generated again.   In AWS Lambda
+the task directory is read-only, so the code is generated again on every cold start.
+Schemas of drafts fastjsonschema does not support (draft 3, 2019-09 and later) are
+validated with jsonschema.
+"""
+import hashlib
+import json
+import os
+import stat
+import sys
+import tempfile
+
+from functools import lru_cache
+from . import codec
+
+CACHE_SIZE = 32
+ENGINE_ENV_VAR = 'CMA_SCHEMA_VALIDATOR'
+JSONSCHEMA_ENGINE = 'jsonschema'
+CODEGEN_ENGINE = 'codegen'
+ENGINES = (JSONSCHEMA_ENGINE, CODEGEN_ENGINE)
+CODEGEN_DRAFTS = ('draft-04', 'draft-06', 'draft-07')
+
+
+class CachedValidator:  # pylint: disable=too-few-public-methods
+    """ A JSON schema and, once first used, its checked validator """
+
+    def __init__(self, schema, filepath=None, engine=JSONSCHEMA_ENGINE):
+        self.schema = schema
+        self.filepath = filepath
+        self.engine = engine
+        self._is_valid = None
+
+    def _compile(self):
+        """ Checks the schema, returns a function telling whether a document is valid """
+        from jsonschema.validators import validator_for
+
+        cls = validator_for(self.schema)
+        cls.check_schema(self.schema)
+        if self.engine == CODEGEN_ENGINE:
+            is_valid = _codegen_is_valid(self.schema, cls, self.filepath)
+            if is_valid:
+                return is_valid
+        return cls(self.schema).is_valid
+
+    def validate(self, document):
+        """ Raises the error jsonschema.validate(document, schema) raises, if any """
+        from jsonschema import validate
+
+        if self._is_valid is None:
+            self._is_valid = self._compile()
+        if not self._is_valid(document):
+            validate(document, self.schema)
+
+
+def _write_atomically(filepath, text):
+    """ Writes a file through a temporary file, does nothing if the directory is read-only """
+    directory, name = os.path.split(filepath)
+    try:
+        descriptor, temporary_path = tempfile.mkstemp(prefix=f'{name}.', dir=directory)
+    except OSError:
+        return
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as temporary_file:
+            temporary_file.write(text)
+        os.replace(temporary_path, filepath)
+    except OSError:
+        os.remove(temporary_path)
+
+
+def _codegen_source(definition, filepath):
+    """
+    Returns the code fastjsonschema generates from a schema definition and the path it is
+    cached at, reading it from that path when cached, or None when it cannot be compiled
+    """
+    import fastjsonschema
+
+    options = {'use_default': False, 'use_formats': False}
+    digest = hashlib.sha256(json.dumps([definition, options, fastjsonschema.VERSION],
+                                       sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    directory, name = os.path.split(filepath)
+    code_path = os.path.join(directory, f'.{name}.{digest}.py')
+    code = _read_generated_code(code_path)
+    if code is not None:
+        return code, code_path
+    try:
+        code = fastjsonschema.compile_to_code(definition, **options)
+    except fastjsonschema.JsonSchemaDefinitionException as error:
+        sys.stderr.write(f'warning {filepath} cannot be compiled, validating with '
+                         f'jsonschema: {error}\n')
+        return None
+    _write_atomically(code_path, _code_header(code) + code)
+    return code, code_path
+
+
+def _code_header(code):
+    """ Returns the first line of a generated code file, the digest of the code """
+    return f'# sha256 {hashlib.sha256(code.encode("utf-8")).hexdigest()}\n'
+
+
+def _read_generated_code(code_path):
+    """
+    Returns the code of a generated code file, None if there is none that can be trusted:
+    written by another user, writable by others, or not matching its digest
+    """
+    try:
+        with open(code_path, encoding='utf-8') as code_file:
+            status = os.fstat(code_file.fileno())
+            content = code_file.read()
+    except OSError:
+        return None
+    if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+        return None
+    if status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return None
+    header, _, code = content.partition('\n')
+    return code if header + '\n' == _code_header(code) else None
+
+
+def _codegen_is_valid(schema, cls, filepath):
+    """
+    Returns a function generated from the schema telling whether a document is valid, or
+    None when fastjsonschema does not support the schema's draft
+    """
+    import fastjsonschema
+
+    draft = cls.META_SCHEMA.get('$schema', '')
+    if not any(name in draft for name in CODEGEN_DRAFTS):
+        return None
+    # use the draft jsonschema picked, the two libraries default to different drafts
+    source = _codegen_source(dict(schema, **{'$schema': draft}), filepath)
+    if source is None:
+        return None
+    code, code_path = source
+    namespace = {}
+    exec(compile(code, code_path, 'exec'), namespace)  # pylint: disable=exec-used
+    generated_validate = namespace['validate']
+
+    def is_valid(document):
+        try:
+            generated_validate(document)
+        except fastjsonschema.JsonSchemaException:
+            return False
+        return True
+    return is_valid
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _load_validator(filepath, _mtime_ns, engine):
+    with open(filepath, 'rb') as schema_file:
+        return CachedValidator(codec.loads(schema_file.read()), filepath, engine)
+
+
+def load_validator(filepath, engine=None):
+    """
+    Returns the CachedValidator of a schema file.   Without an engine the one selected by
+    CMA_SCHEMA_VALIDATOR is used
+    """
+    engine = engine or os.environ.get(ENGINE_ENV_VAR, JSONSCHEMA_ENGINE)
+    if engine not in ENGINES:
+        raise LookupError(f'Unknown schema validator {engine}, expected one of {list(ENGINES)}')
+    filepath = os.path.realpath(filepath)
+    return _load_validator(filepath, os.stat(filepath).st_mtime_ns, engine)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def schema_exists(filepath):
+    """ Returns whether a schema file exists, the answer is cached for the process """
+    return os.path.exists(filepath)
+
+
+def cache_info():
+    """ Returns the hits, misses, maxsize and currsize of the validator cache """
+    return _load_validator.cache_info()  # pylint: disable=no-value-for-parameter
+
+
+def cache_clear():
+    """ Empties the validator and schema_exists caches """
+    _load_validator.cache_clear()
+    schema_exists.cache_clear()
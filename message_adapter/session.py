@@ -0,0 +1,46 @@
+""" Keeps resolved Cumulus messages in a stream process between CMA commands """
+import threading
+import uuid
+
+from collections import OrderedDict
+
+
+class SessionStore:
+    """
+    Bounded, thread safe store of events keyed by an opaque session handle.   When more
+    than max_sessions are open the least recently used session is discarded.
+    """
+    DEFAULT_MAX_SESSIONS = 64
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, event):
+        """ Stores an event and returns the handle that refers to it """
+        handle = uuid.uuid4().hex
+        with self._lock:
+            self._events[handle] = event
+            while len(self._events) > self.max_sessions:
+                self._events.popitem(last=False)
+        return handle
+
+    def get(self, handle):
+        """ Returns the event stored for a handle """
+        with self._lock:
+            if handle not in self._events:
+                raise LookupError(f'Unknown or expired CMA session {handle}')
+            self._events.move_to_end(handle)
+            return self._events[handle]
+
+    def release(self, handle):
+        """ Removes a session from the store and returns its event """
+        with self._lock:
+            if handle not in self._events:
+                raise LookupError(f'Unknown or expired CMA session {handle}')
+            return self._events.pop(handle)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._events)
@@ -0,0 +1,205 @@
+"""
+Compiled JSONPath templates.
+
+A template string is classified once (value, array, inline or plain string) and its
+JSONPaths are compiled once by compile_template().   A whole task configuration is compiled
+by compile_config() into a plan that marks constant subtrees and holds the compiled
+templates, cached by a fingerprint of the configuration so the same task configuration
+is only analysed once per process.   Every path used by a plan is gathered in a PathSet, so
+resolving the plan traverses the message once rather than once per template.
+"""
+import json
+import os
+import re
+
+from functools import lru_cache
+from .jsonpath import PathSet, compile_path
+
+CACHE_SIZE_ENV_VAR = 'CMA_TEMPLATE_CACHE_SIZE'
+DEFAULT_CACHE_SIZE = 256
+
+_VALUE_REGEX = re.compile(r"^{[^\[\]].*}$")
+_ARRAY_REGEX = re.compile(r"^{\[.*\]}$")
+_TEMPLATE_REGEX = re.compile('{[^}]+}')
+
+
+def _find(json_path, event, found):
+    """ Returns the matches of a compiled path, from found when it was resolved in a batch """
+    return json_path.find(event) if found is None else found.get(json_path, [])
+
+
+class ValueTemplate:  # pylint: disable=too-few-public-methods
+    """ "{$.path}" or "{{$.path}}", resolves to the first match or None """
+
+    def __init__(self, json_path):
+        self.json_path = compile_path(json_path)
+        self.paths = [self.json_path]
+
+    def resolve(self, event, found=None):
+        """ Returns the template resolved against event """
+        match_data = _find(self.json_path, event, found)
+        return match_data[0] if match_data else None
+
+
+class ArrayTemplate:  # pylint: disable=too-few-public-methods
+    """ "{[$.path]}", resolves to the list of all matches """
+
+    def __init__(self, json_path):
+        self.json_path = compile_path(json_path)
+        self.paths = [self.json_path]
+
+    def resolve(self, event, found=None):
+        """ Returns the template resolved against event """
+        return _find(self.json_path, event, found)
+
+
+class InlineTemplate:  # pylint: disable=too-few-public-methods
+    """ "some{$.path}value", each template is replaced by its first match """
+
+    def __init__(self, template):
+        self.template = template
+        self.matches = [(match, compile_path(match.lstrip('{').rstrip('}')))
+                        for match in _TEMPLATE_REGEX.findall(template)]
+        self.paths = [json_path for (_, json_path) in self.matches]
+
+    def resolve(self, event, found=None):
+        """ Returns the template resolved against event """
+        result = self.template
+        for match, json_path in self.matches:
+            match_data = _find(json_path, event, found)
+            if match_data:
+                result = result.replace(match, match_data[0])
+        return result
+
+
+@lru_cache(maxsize=int(os.environ.get(CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_SIZE)))
+def compile_template(json_path_string):
+    """
+    Returns the compiled template for a string, or None if the string contains no template
+    and resolves to itself
+    """
+    if _VALUE_REGEX.search(json_path_string):
+        return ValueTemplate(json_path_string.lstrip('{').rstrip('}'))
+    if _ARRAY_REGEX.search(json_path_string):
+        return ArrayTemplate(json_path_string.lstrip('{').rstrip('}').lstrip('[').rstrip(']'))
+    if _TEMPLATE_REGEX.search(json_path_string):
+        return InlineTemplate(json_path_string)
+    return None
+
+
+class ConstantPlan:  # pylint: disable=too-few-public-methods
+    """ A subtree without templates, resolves to the configuration subtree itself """
+    paths = []
+
+    @staticmethod
+    def resolve(_event, config, _found=None):
+        """ Returns config unchanged """
+        return config
+
+
+CONSTANT = ConstantPlan()
+
+
+class TemplatePlan:  # pylint: disable=too-few-public-methods
+    """ A templated string """
+
+    def __init__(self, template):
+        self.template = template
+        self.paths = template.paths
+
+    def resolve(self, event, _config, found=None):
+        """ Returns the template resolved against event """
+        return self.template.resolve(event, found)
+
+
+class ListPlan:  # pylint: disable=too-few-public-methods
+    """ A list containing templates """
+
+    def __init__(self, items):
+        self.items = items
+        self.paths = [path for plan in items for path in plan.paths]
+
+    def resolve(self, event, config, found=None):
+        """ Returns a new list with every item resolved """
+        return [plan.resolve(event, item, found) for (plan, item) in zip(self.items, config)]
+
+
+class DictPlan:  # pylint: disable=too-few-public-methods
+    """ A dict containing templates """
+
+    def __init__(self, items):
+        self.items = items
+        self.paths = [path for plan in items.values() for path in plan.paths]
+
+    def resolve(self, event, config, found=None):
+        """ Returns a new dict with every value resolved """
+        return {key: self.items[key].resolve(event, value, found)
+                for (key, value) in config.items()}
+
+
+def _build_plan(config):
+    """ Builds the resolution plan of a configuration subtree """
+    if isinstance(config, str):
+        template = compile_template(config)
+        return TemplatePlan(template) if template else CONSTANT
+    if isinstance(config, list):
+        items = [_build_plan(item) for item in config]
+        return ListPlan(items) if any(item is not CONSTANT for item in items) else CONSTANT
+    if isinstance(config, dict):
+        items = {key: _build_plan(value) for (key, value) in config.items()}
+        if any(item is not CONSTANT for item in items.values()):
+            return DictPlan(items)
+    return CONSTANT
+
+
+class ConfigPlan:
+    """
+    The compiled form of a task configuration and, optionally, of its
+    cumulus_message.input template.   All of their paths are resolved in one traversal
+    """
+
+    def __init__(self, config, input_template=None):
+        self.config = _build_plan(config)
+        self.input = _build_plan(input_template)
+        paths = self.config.paths + self.input.paths
+        self.path_set = PathSet(paths) if paths else None
+
+    def resolve(self, event, config):
+        """ Returns config, the configuration this plan was compiled from, resolved """
+        return self.resolve_with_input(event, config)[0]
+
+    def resolve_with_input(self, event, config, input_template=None):
+        """
+        Returns (resolved config, resolved input template) for the configuration and
+        input template this plan was compiled from
+        """
+        found = self.path_set.find(event) if self.path_set else None
+        return (self.config.resolve(event, config, found),
+                self.input.resolve(event, input_template, found))
+
+
+@lru_cache(maxsize=int(os.environ.get(CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_SIZE)))
+def _compile_fingerprint(config_fingerprint, input_fingerprint):
+    return ConfigPlan(json.loads(config_fingerprint), json.loads(input_fingerprint))
+
+
+def compile_config(config, input_template=None):
+    """
+    Returns the resolution plan of a configuration.   Call plan.resolve(event, config)
+    with the same configuration to resolve all of its templates against event, or
+    plan.resolve_with_input(event, config, input_template) to also resolve the
+    cumulus_message.input template in the same traversal
+    """
+    return _compile_fingerprint(json.dumps(config, sort_keys=True),
+                                json.dumps(input_template, sort_keys=True))
+
+
+def cache_info():
+    """ Returns the hits, misses, maxsize and currsize of the configuration plan cache """
+    return _compile_fingerprint.cache_info()  # pylint: disable=no-value-for-parameter
+
+
+def cache_clear():
+    """ Empties the configuration plan and template caches """
+    _compile_fingerprint.cache_clear()
+    compile_template.cache_clear()
@@ -0,0 +1,219 @@
+"""
+Transfers of the message portions stored in S3.
+
+put_object() writes a body in a single request, or, once it reaches
+CMA_S3_MULTIPART_THRESHOLD bytes (default 64 MiB), with a multipart upload whose parts of
+CMA_S3_PART_SIZE bytes (default 16 MiB, S3 requires at least 5 MiB) are uploaded in
+parallel by up to CMA_S3_CONCURRENCY threads (default 8).   The parts are read from the
+serialized body as it is, which the caller already holds to compare its size with
+ReplaceConfig.MaxSize, so at most CMA_S3_CONCURRENCY parts are copied at any time.
+
+get_object() reads objects as a single GET does, unless the size of the object, given by
+that GET, reaches CMA_S3_RANGED_GET_THRESHOLD bytes (default 64 MiB).   The first part is
+then read from that response and the others are fetched with ranged GETs of the object's
+ETag by up to CMA_S3_CONCURRENCY threads.   Every part is read straight into its place in
+one buffer, which the JSON decoder reads without copying it.
+
+Content addressed objects are named after a digest of their content by content_key(), and
+put_object_once() only writes them when they do not exist yet.
+"""
+import hashlib
+import io
+import os
+
+from datetime import datetime, timedelta, timezone
+
+from concurrent.futures import ThreadPoolExecutor
+from . import disk_cache
+
+MULTIPART_THRESHOLD_ENV_VAR = 'CMA_S3_MULTIPART_THRESHOLD'
+DEFAULT_MULTIPART_THRESHOLD = 64 * 1024 * 1024
+PART_SIZE_ENV_VAR = 'CMA_S3_PART_SIZE'
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+CONCURRENCY_ENV_VAR = 'CMA_S3_CONCURRENCY'
+DEFAULT_CONCURRENCY = 8
+RANGED_GET_THRESHOLD_ENV_VAR = 'CMA_S3_RANGED_GET_THRESHOLD'
+DEFAULT_RANGED_GET_THRESHOLD = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+# existing content addressed objects older than this are copied onto themselves, which
+# renews their Last-Modified for the bucket's lifecycle rules
+CONTENT_ADDRESSED_REFRESH_AGE = timedelta(days=1)
+
+
+class BufferReader(io.RawIOBase):
+    """ A binary stream reading an object downloaded whole, the bytearray data """
+
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+        self._view = memoryview(data)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+
+def _part_size():
+    return int(os.environ.get(PART_SIZE_ENV_VAR, DEFAULT_PART_SIZE))
+
+
+def _concurrency():
+    return int(os.environ.get(CONCURRENCY_ENV_VAR, DEFAULT_CONCURRENCY))
+
+
+def multipart_threshold():
+    """ Returns the size from which bodies are uploaded in parts """
+    return int(os.environ.get(MULTIPART_THRESHOLD_ENV_VAR, DEFAULT_MULTIPART_THRESHOLD))
+
+
+def transfer_config():
+    """ Returns the boto3 TransferConfig of multipart transfers """
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=multipart_threshold(),
+        multipart_chunksize=_part_size(),
+        max_concurrency=_concurrency(),
+        use_threads=True)
+
+
+def put_object(s3_object, body, **params):
+    """
+    Writes body to a boto3 S3 Object, with the other put parameters (Expires,
+    ContentEncoding...), uploading large bodies in parallel parts
+    """
+    if len(body) < multipart_threshold():
+        return s3_object.put(Body=body, **params)
+    # BytesIO shares the bytes of body until it is written to
+    return s3_object.upload_fileobj(io.BytesIO(body), ExtraArgs=params, Config=transfer_config())
+
+
+def content_key(body, content_encoding=None):
+    """
+    Returns the key of a content addressed object, from the serialized body before it is
+    compressed, as compressed bodies differ with the compression level or time
+    """
+    key = f'events/sha256-{hashlib.sha256(body).hexdigest()}'
+    return f'{key}.{content_encoding}' if content_encoding else key
+
+
+def put_object_once(s3_object, body, **params):
+    """
+    put_object() for content addressed objects: does nothing if the object exists, only
+    renewing its Last-Modified once it is CONTENT_ADDRESSED_REFRESH_AGE old.   Without
+    s3:ListBucket S3 answers 403 instead of 404 for missing objects, so both are taken as
+    absent.   Returns whether the body was written
+    """
+    try:
+        head = s3_object.meta.client.head_object(Bucket=s3_object.bucket_name,
+                                                 Key=s3_object.key)
+    except Exception as error:  # pylint: disable=broad-except
+        if _status(error) not in (403, 404):
+            raise
+        put_object(s3_object, body, **params)
+        return True
+    if head['LastModified'] < datetime.now(timezone.utc) - CONTENT_ADDRESSED_REFRESH_AGE:
+        s3_object.copy_from(CopySource={'Bucket': s3_object.bucket_name, 'Key': s3_object.key},
+                            MetadataDirective='REPLACE', **params)
+    return False
+
+
+def get_object(s3_object):
+    """
+    Returns the response of a GET of a boto3 S3 Object.   For large objects its Body is a
+    BufferReader of the object, downloaded with parallel ranged GETs.   With the disk cache
+    enabled (see message_adapter.disk_cache) unchanged objects are read from the cache
+    """
+    cache = disk_cache.get_cache()
+    cached = cache.lookup(s3_object.bucket_name, s3_object.key) if cache else None
+    try:
+        data = s3_object.get(IfNoneMatch=cached.etag) if cached else s3_object.get()
+    except Exception as error:
+        if cached and _not_modified(error):
+            return _read_cached(cached.response())
+        if cached:
+            cached.close()
+        raise
+    if cached:
+        cached.close()
+    size = data.get('ContentLength') or 0
+    if size < _ranged_get_threshold():
+        if cache:
+            data['Body'] = cache.reader(s3_object.bucket_name, s3_object.key, data)
+        return data
+    data['Body'] = BufferReader(_download(s3_object, data, size))
+    if cache:
+        cache.store(s3_object.bucket_name, s3_object.key, data, data['Body'].data)
+    return data
+
+
+def _ranged_get_threshold():
+    return int(os.environ.get(RANGED_GET_THRESHOLD_ENV_VAR, DEFAULT_RANGED_GET_THRESHOLD))
+
+
+def _status(error):
+    """ Returns the HTTP status code of a botocore ClientError, None for other errors """
+    response = getattr(error, 'response', None) or {}
+    return response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+
+
+def _not_modified(error):
+    """ Returns whether a botocore ClientError is a 304 Not Modified answer """
+    return _status(error) == 304
+
+
+def _read_cached(data):
+    """ Reads a large cached object into a buffer, as if it was downloaded """
+    if data['ContentLength'] < _ranged_get_threshold():
+        return data
+    with data['Body'] as cached_file:
+        buffer = bytearray(data['ContentLength'])
+        if cached_file.readinto(buffer) != len(buffer):
+            raise IOError(f'{cached_file.name} is shorter than {len(buffer)} bytes')
+    data['Body'] = BufferReader(buffer)
+    return data
+
+
+def _read_into(view, body, start, end):
+    """ Reads the bytes start to end of an object from body into view """
+    position = start
+    while position < end:
+        chunk = body.read(min(READ_SIZE, end - position))
+        if not chunk:
+            raise IOError(f'Object ended at byte {position} instead of {end}')
+        view[position:position + len(chunk)] = chunk
+        position += len(chunk)
+
+
+def _download(s3_object, data, size):
+    """
+    Returns a bytearray of the object of a GET response, reading its first part from the
+    response and the others with ranged GETs of the same version of the object
+    """
+    client = s3_object.meta.client
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    part_size = _part_size()
+
+    def fetch(start):
+        end = min(start + part_size, size)
+        response = client.get_object(Bucket=s3_object.bucket_name, Key=s3_object.key,
+                                     Range=f'bytes={start}-{end - 1}', IfMatch=data['ETag'])
+        _read_into(view, response['Body'], start, end)
+
+    with ThreadPoolExecutor(max_workers=_concurrency()) as pool:
+        parts = [pool.submit(fetch, start) for start in range(part_size, size, part_size)]
+        try:
+            _read_into(view, data['Body'], 0, min(part_size, size))
+        finally:
+            # the rest of the first response is not read
+            data['Body'].close()
+        for part in parts:
+            part.result()
+    return buffer
@@ -1,5 +1,11 @@
-from copy import deepcopy
-from jsonpath_ng import parse
+import threading
+import time
+
+from collections import OrderedDict, namedtuple
+from .copy_on_write import CopyOnWrite
+from .jsonpath import compile_path
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
 
 
 def assign_json_path_value(source_message, jspath, value):
@@ -7,25 +13,83 @@ def assign_json_path_value(source_message, jspath, value):
     * Assign (update or insert) a value to message based on jsonpath.
     * Create the keys if jspath doesn't already exist in the message. In this case, we
     * support 'simple' jsonpath like $.path1.path2.path3....
+    * source_message is not modified, the updated message shares its unchanged parts
     * @param {dict} source_message The message to be updated
     * @param {string} jspath JSON path string
     * @param {*} value Value to update to
     * @return {*} updated message
     """
-    message = deepcopy(source_message)
-    if not parse(jspath).find(message):
+    message = CopyOnWrite(source_message)
+    assign_json_path(message, jspath, value)
+    return message.document
+
+
+def assign_json_path(message, jspath, value):
+    """
+    * assign_json_path_value applied to a copy-on-write message, which is updated
+    * @param {CopyOnWrite} message The message to be updated
+    * @param {string} jspath JSON path string
+    * @param {*} value Value to update to
+    """
+    json_path = compile_path(jspath)
+    if not json_path.find(message.document):
         paths = jspath.lstrip('$.').split('.')
-        current_item = message
-        key_not_found = False
-        for path in paths:
-            if key_not_found or path not in current_item:
-                key_not_found = True
-                new_path_dict = {}
-                # Add missing key to existing dict
-                current_item[path] = new_path_dict
-                # Set current item to newly created dict
-                current_item = new_path_dict
-            else:
-                current_item = current_item[path]
-    parse(jspath).update(message, value)
-    return message
+        current_item = message.document
+        for index, path in enumerate(paths):
+            if path not in current_item:
+                current_item = message.writable(paths[:index])
+                for missing_path in paths[index:]:
+                    # Add missing key to existing dict
+                    current_item[missing_path] = {}
+                    # Set current item to newly created dict
+                    current_item = current_item[missing_path]
+                break
+            current_item = current_item[path]
+    message.update(json_path, value)
+
+
+class TTLCache:
+    """
+    A thread safe, size bounded cache whose entries expire ttl seconds after they were
+    stored.   Once maxsize entries are stored the least recently used one is evicted
+    """
+
+    def __init__(self, maxsize, ttl, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Returns the value stored for key, or default if it is missing or expired """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.timer():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """ Stores value for key """
+        with self._lock:
+            self._entries[key] = (self.timer() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """ Empties the cache and resets its statistics """
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def cache_info(self):
+        """ Returns the hits, misses, maxsize and currsize of the cache """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._entries))
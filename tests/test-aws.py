@@ -0,0 +1,237 @@
+"""
+Tests for message_adapter AWS client management
+"""
+import io
+import os
+import threading
+import unittest
+
+from contextlib import redirect_stderr
+from mock import patch
+from message_adapter import aws
+from message_adapter.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+from message_adapter.util import TTLCache
+
+STATE_MACHINE_ARN = 'arn:aws:states:us-east-1:123:stateMachine:Example'
+LAMBDA_ARN = 'arn:aws:lambda:us-east-1:123:function:fakeStep'
+
+
+class FakeStepFunctions:  # pylint: disable=too-few-public-methods
+    """ Serves an execution history newest first, in pages, like GetExecutionHistory """
+
+    def __init__(self, events, errors=()):
+        self.events = events
+        self.errors = list(errors)
+        self.requests = []
+
+    def get_execution_history(self, executionArn, maxResults, reverseOrder, nextToken=None):
+        # pylint: disable=invalid-name
+        """ Returns one page of the history, or raises the next of errors """
+        assert reverseOrder
+        self.requests.append((executionArn, nextToken))
+        if self.errors:
+            raise self.errors.pop(0)
+        newest_first = sorted(self.events, key=lambda event: -event['id'])
+        start = int(nextToken or 0)
+        page = {'events': newest_first[start:start + maxResults]}
+        if start + maxResults < len(newest_first):
+            page['nextToken'] = str(start + maxResults)
+        return page
+
+
+def task_events(first_id, task_name, resource):
+    """ Returns the events of a task run by an execution, starting at first_id """
+    return [
+        {'id': first_id, 'previousEventId': first_id - 1, 'type': 'TaskStateEntered',
+         'stateEnteredEventDetails': {'name': task_name, 'input': '{}'}},
+        {'id': first_id + 1, 'previousEventId': first_id, 'type': 'LambdaFunctionScheduled',
+         'lambdaFunctionScheduledEventDetails': {'resource': resource}},
+        {'id': first_id + 2, 'previousEventId': first_id + 1, 'type': 'LambdaFunctionStarted'},
+    ]
+
+
+def map_iteration_events(first_id, count):
+    """ Returns count events that do not identify a task """
+    return [{'id': event_id, 'previousEventId': event_id - 1, 'type': 'MapIterationStarted'}
+            for event_id in range(first_id, first_id + count)]
+
+
+class ThrottlingException(Exception):
+    """ An error shaped like botocore's ClientError for a throttled request """
+    response = {'Error': {'Code': 'ThrottlingException'},
+                'ResponseMetadata': {'HTTPStatusCode': 400}}
+
+
+class Test(unittest.TestCase):
+    """ Test class """
+
+    def setUp(self):
+        aws.reset_clients()
+        aws.task_name_cache_clear()
+
+    def tearDown(self):
+        aws.reset_clients()
+        aws.task_name_cache_clear()
+
+    def test_s3_resource_is_cached_per_thread(self):
+        """ A thread reuses its S3 resource, other threads get their own """
+        resource = aws.s3()
+        assert aws.s3() is resource
+        other = []
+        thread = threading.Thread(target=lambda: other.append(aws.s3()))
+        thread.start()
+        thread.join()
+        assert other[0] is not resource
+
+    def test_step_functions_client_is_shared(self):
+        """ The Step Functions client is created once for all threads """
+        client = aws.stepFn()
+        other = []
+        thread = threading.Thread(target=lambda: other.append(aws.stepFn()))
+        thread.start()
+        thread.join()
+        assert other[0] is client
+
+    def test_reset_clients(self):
+        """ reset_clients drops the cached clients and resources """
+        resource, client = aws.s3(), aws.stepFn()
+        aws.reset_clients()
+        assert aws.s3() is not resource
+        assert aws.stepFn() is not client
+
+    def test_clients_follow_the_environment(self):
+        """ The endpoint and pool size are read from the environment """
+        environ = {'LOCALSTACK_HOST': 'other-host', aws.MAX_POOL_CONNECTIONS_ENV_VAR: '32'}
+        with patch.dict(os.environ, environ):
+            client = aws.stepFn()
+            assert client.meta.config.max_pool_connections == 32
+            if os.environ.get('CUMULUS_ENV') == 'testing':
+                assert client.meta.endpoint_url == 'http://other-host:4572'
+                assert aws.s3().meta.client.meta.endpoint_url == 'http://other-host:4572'
+        assert aws.stepFn() is not client
+
+    @patch.object(aws, 'stepFn')
+    def test_task_names_are_cached(self, step_fn):
+        """ Repeated lookups for one execution, resource and invocation query the API once """
+        history = FakeStepFunctions(task_events(1, 'Example', LAMBDA_ARN))
+        step_fn.return_value = history
+        for _ in range(3):
+            assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN,
+                                            'request-1') == 'Example'
+        assert len(history.requests) == 1
+        history.events += task_events(4, 'Next', LAMBDA_ARN)
+        assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN,
+                                        'request-2') == 'Next'
+        assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'other', LAMBDA_ARN,
+                                        'request-2') == 'Next'
+        assert len(history.requests) == 3
+        assert aws.task_name_cache_info()[:2] == (2, 3)
+        # counted once per invocation
+        assert aws.task_name_source_counts() == {'api': 2}
+
+    @patch.object(aws, 'stepFn')
+    def test_task_name_lookups_are_reported_on_stderr(self, step_fn):
+        """ Every counted lookup writes its source, the counts and the cache statistics """
+        step_fn.return_value = FakeStepFunctions(task_events(1, 'Example', LAMBDA_ARN))
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            for _ in range(2):
+                aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN,
+                                         'request-1')
+            aws.count_task_name_source('message', 'request-2')
+            aws.count_task_name_source('message', 'request-2')
+        assert stderr.getvalue().splitlines() == [
+            'info task name source=api lookups api=1 message=0 cache_hits=0 cache_misses=1',
+            'info task name source=message lookups api=1 message=1 cache_hits=1 cache_misses=1',
+        ]
+
+    @patch.object(aws, 'stepFn')
+    def test_task_names_without_invocation_id_are_not_cached(self, step_fn):
+        """ Lookups without an invocation id, from activities, query the API every time """
+        history = FakeStepFunctions(task_events(1, 'Example', LAMBDA_ARN))
+        step_fn.return_value = history
+        assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN) == 'Example'
+        history.events += task_events(4, 'Next', LAMBDA_ARN)
+        assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN) == 'Next'
+        assert len(history.requests) == 2
+        info = aws.task_name_cache_info()
+        assert (info[0], info[1], info[3]) == (0, 0, 0)
+        assert aws.task_name_source_counts() == {'api': 2}
+
+    def test_ttl_cache(self):
+        """ Entries expire after the TTL and the least recently used entry is evicted """
+        now = [0]
+        cache = TTLCache(2, 10, timer=lambda: now[0])
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        now[0] = 10
+        assert cache.get('a') is None
+        assert cache.get('c', 'default') == 'default'
+        assert cache.cache_info() == (1, 3, 2, 0)
+
+    @patch.object(aws, 'stepFn')
+    def test_history_scan_stops_at_the_match(self, step_fn):
+        """ The history is paged only as far back as the task """
+        history = FakeStepFunctions(
+            [{'id': 1, 'previousEventId': 0, 'type': 'ExecutionStarted'}] +
+            map_iteration_events(2, 100) + task_events(102, 'Example', LAMBDA_ARN))
+        step_fn.return_value = history
+        assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN) == 'Example'
+        assert len(history.requests) == 1
+
+    @patch.object(aws, 'stepFn')
+    def test_history_scan_pages_past_the_first_page(self, step_fn):
+        """ Tasks followed by many other events are found on older pages """
+        history = FakeStepFunctions(
+            [{'id': 1, 'previousEventId': 0, 'type': 'ExecutionStarted'}] +
+            task_events(2, 'Example', LAMBDA_ARN) + map_iteration_events(5, 100))
+        step_fn.return_value = history
+        assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN) == 'Example'
+        assert [token for (_, token) in history.requests] == [None, '40', '80']
+
+        history.events = map_iteration_events(1, 100)
+        with self.assertRaises(LookupError):
+            aws.get_current_sfn_task(STATE_MACHINE_ARN, 'without-tasks', LAMBDA_ARN)
+
+    @patch.object(aws, 'stepFn')
+    def test_history_is_fetched_incrementally(self, step_fn):
+        """ Later lookups in an execution only fetch the events added since """
+        history = FakeStepFunctions(
+            [{'id': 1, 'previousEventId': 0, 'type': 'ExecutionStarted'}] +
+            task_events(2, 'First', LAMBDA_ARN))
+        step_fn.return_value = history
+        assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN,
+                                        'request-1') == 'First'
+        history.events += map_iteration_events(5, 50) + task_events(55, 'Second', LAMBDA_ARN)
+        history.requests = []
+        assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN,
+                                        'request-2') == 'Second'
+        assert [token for (_, token) in history.requests] == [None, '40']
+        index = aws._get_execution_history(  # pylint: disable=protected-access
+            f'{STATE_MACHINE_ARN.replace(":stateMachine:", ":execution:")}:execution')
+        assert [event['id'] for event in index.events] == list(range(57, 0, -1))
+        assert 'input' not in str(index.events)
+
+    @patch.object(aws, 'stepFn')
+    def test_throttled_lookups_are_retried(self, step_fn):
+        """ Throttled history requests are retried, then the circuit breaker fails fast """
+        sleeps = []
+        breaker = CircuitBreaker('Step Functions', 3, 30)
+        with patch.object(aws, 'sfn_retry', RetryPolicy(5, 0.1, 1, 60, breaker,
+                                                         sleep=sleeps.append)):
+            step_fn.return_value = FakeStepFunctions(task_events(1, 'Example', LAMBDA_ARN),
+                                                     [ThrottlingException()] * 2)
+            assert aws.get_current_sfn_task(STATE_MACHINE_ARN, 'execution', LAMBDA_ARN) == \
+                'Example'
+            assert len(sleeps) == 2
+
+            step_fn.return_value = FakeStepFunctions(task_events(1, 'Example', LAMBDA_ARN),
+                                                     [ThrottlingException()] * 10)
+            with self.assertRaises(ThrottlingException):
+                aws.get_current_sfn_task(STATE_MACHINE_ARN, 'other', LAMBDA_ARN)
+            with self.assertRaises(CircuitOpenError):
+                aws.get_current_sfn_task(STATE_MACHINE_ARN, 'another', LAMBDA_ARN)
+            assert len(step_fn.return_value.requests) == 3
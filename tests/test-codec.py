@@ -0,0 +1,149 @@
+"""
+Conformance tests for the message_adapter JSON codec backends
+"""
+import io
+import json
+import os
+import unittest
+
+from mock import patch
+
+from message_adapter import codec
+
+
+def available_backends():
+    """ Returns an instance of every codec backend installed in this environment """
+    backends = []
+    for name in sorted(codec.BACKENDS):
+        try:
+            backends.append(codec.get_backend(name))
+        except ImportError:
+            pass
+    return backends
+
+
+class Test(unittest.TestCase):
+    """ Test class """
+    examples_folder = os.path.join(os.getcwd(), 'examples')
+
+    def example_documents(self):
+        """ Yields (filename, raw bytes) of every JSON document under examples/ """
+        for folder in ('messages', 'schemas', 'contexts', 'responses'):
+            path = os.path.join(self.examples_folder, folder)
+            for filename in sorted(os.listdir(path)):
+                if filename.endswith('.json'):
+                    with open(os.path.join(path, filename), 'rb') as document:
+                        yield filename, document.read()
+
+    def test_decodes_examples_like_stdlib(self):
+        """ Every backend decodes the example documents to the objects json.loads returns """
+        for backend in available_backends():
+            for filename, raw in self.example_documents():
+                expected = json.loads(raw)
+                self.assertEqual(backend.loads(raw), expected, (backend.name, filename))
+                self.assertEqual(backend.loads(raw.decode('utf-8')), expected,
+                                 (backend.name, filename))
+                self.assertEqual(backend.loads(bytearray(raw)), expected,
+                                 (backend.name, filename))
+                self.assertEqual(backend.loads(memoryview(raw)), expected,
+                                 (backend.name, filename))
+
+    def test_encodes_examples_like_stdlib(self):
+        """ Every backend encodes the example documents to JSON equal to json.dumps output """
+        for backend in available_backends():
+            for filename, raw in self.example_documents():
+                document = json.loads(raw)
+                self.assertEqual(json.loads(backend.dumps(document)), document,
+                                 (backend.name, filename))
+                self.assertEqual(json.loads(backend.dumpb(document)), document,
+                                 (backend.name, filename))
+
+    def test_falls_back_for_documents_outside_fast_backend_range(self):
+        """ Wide integers, NaN literals and non-string keys behave as with the stdlib """
+        for backend in available_backends():
+            wide = '{"big": 123456789012345678901234567890, "nan": NaN}'
+            decoded = backend.loads(wide)
+            self.assertEqual(decoded['big'], 123456789012345678901234567890)
+            self.assertNotEqual(decoded['nan'], decoded['nan'])
+            self.assertEqual(json.loads(backend.dumps({1: [2 ** 70]})), {'1': [2 ** 70]})
+
+    def test_non_finite_floats_are_not_lost(self):
+        """ Decoded NaN and infinite floats are encoded as the stdlib does, never as null """
+        for backend in available_backends():
+            document = backend.loads('{"values": [1.5, NaN, {"max": Infinity}], "id": null}')
+            self.assertEqual(backend.dumps(document),
+                             '{"values": [1.5, NaN, {"max": Infinity}], "id": null}',
+                             backend.name)
+            decoded = backend.loads(backend.dumpb(document))
+            self.assertNotEqual(decoded['values'][1], decoded['values'][1])
+            self.assertEqual(decoded['values'][2]['max'], float('inf'))
+
+    def test_documents_without_non_finite_floats_are_not_walked(self):
+        """ Fast backends only search encoded nulls for NaN after decoding one """
+        for backend in available_backends():
+            with patch.object(codec, '_has_non_finite_float',
+                              wraps=codec._has_non_finite_float) as has_non_finite_float:
+                document = backend.loads('{"granules": [{"id": null}]}')
+                self.assertEqual(backend.loads(backend.dumpb(document)), document)
+            has_non_finite_float.assert_not_called()
+
+    def test_default_backend_encodes_like_stdlib(self):
+        """ Without CMA_JSON_CODEC output, and so the MaxSize estimate, match json.dumps """
+        with patch.dict(os.environ, {}, clear=False):
+            os.environ.pop(codec.CODEC_ENV_VAR, None)
+            codec.reset()
+            try:
+                for filename, raw in self.example_documents():
+                    document = json.loads(raw)
+                    self.assertEqual(codec.dumpb(document), json.dumps(document).encode(),
+                                     filename)
+                document = {'cumulus_meta': {'execution_name': 'e'}, 'payload': [None, 1.0]}
+                self.assertEqual(len(codec.dumpb(document)), 65)
+            finally:
+                codec.reset()
+
+    def test_invalid_documents_raise_json_decode_error(self):
+        """ Invalid documents raise json.JSONDecodeError with every backend """
+        for backend in available_backends():
+            with self.assertRaises(json.JSONDecodeError):
+                backend.loads('{"unterminated": ')
+
+    def test_backend_selected_by_environment(self):
+        """ CMA_JSON_CODEC selects the backend, unknown names are rejected """
+        os.environ[codec.CODEC_ENV_VAR] = 'json'
+        try:
+            codec.reset()
+            self.assertEqual(codec.dumps({'a': 1}), '{"a": 1}')
+            os.environ[codec.CODEC_ENV_VAR] = 'no-such-codec'
+            codec.reset()
+            with self.assertRaises(LookupError):
+                codec.loads('{}')
+        finally:
+            del os.environ[codec.CODEC_ENV_VAR]
+            codec.reset()
+
+    def test_streamed_documents_decode_like_stdlib(self):
+        """ load decodes streamed example documents to the objects json.loads returns """
+        with patch.dict(os.environ, {codec.STREAM_MIN_SIZE_ENV_VAR: '0'}):
+            for filename, raw in self.example_documents():
+                self.assertEqual(codec.load(io.BytesIO(raw)), json.loads(raw), filename)
+                self.assertEqual(codec.load(io.BytesIO(raw), len(raw)), json.loads(raw),
+                                 filename)
+
+    def test_streaming_rejects_documents_outside_its_range(self):
+        """ Documents the streaming parser rejects raise StreamingDecodeError """
+        wide = b'{"big": 123456789012345678901234567890, "nan": NaN}'
+        try:
+            import ijson  # pylint: disable=unused-import,import-outside-toplevel
+        except ImportError:
+            self.skipTest('ijson is not installed')
+        with self.assertRaises(codec.StreamingDecodeError):
+            codec.load(io.BytesIO(wide))
+        with self.assertRaises(codec.StreamingDecodeError):
+            codec.load(io.BytesIO(b'{"a": 1} {"b": 2}'))
+        granules = codec.load(io.BytesIO(b'[{"granuleId": "g1"}, {"granuleId": "g2"}]'))
+        self.assertEqual(granules, [{'granuleId': 'g1'}, {'granuleId': 'g2'}])
+        self.assertIs(list(granules[0])[0], list(granules[1])[0])
+        # small documents are read whole
+        self.assertEqual(codec.load(io.BytesIO(wide), len(wide))['big'],
+                         123456789012345678901234567890)
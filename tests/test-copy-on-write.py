@@ -0,0 +1,81 @@
+"""
+Tests for the message_adapter copy-on-write message view
+"""
+import unittest
+
+from copy import deepcopy
+from message_adapter.copy_on_write import CopyOnWrite
+from message_adapter.jsonpath import compile_path
+from message_adapter.util import assign_json_path_value
+
+
+class Test(unittest.TestCase):
+    """ Test class """
+
+    def setUp(self):
+        self.event = {
+            'meta': {'collection': {'name': 'MOD09GQ'}, 'workflow_tasks': {}},
+            'payload': {'granules': [{'granuleId': 'g1'}, {'granuleId': 'g2'}]},
+        }
+        self.original = deepcopy(self.event)
+
+    def test_writable_copies_only_the_path(self):
+        """ Containers along the written path are copied, everything else is shared """
+        message = CopyOnWrite(self.event)
+        message.writable(['meta', 'workflow_tasks'])['task'] = {'name': 'task'}
+        assert self.event == self.original
+        assert message.document['meta']['workflow_tasks'] == {'task': {'name': 'task'}}
+        assert message.document is not self.event
+        assert message.document['meta'] is not self.event['meta']
+        assert message.document['meta']['collection'] is self.event['meta']['collection']
+        assert message.document['payload'] is self.event['payload']
+
+    def test_containers_are_copied_once(self):
+        """ A container the view already owns is written in place """
+        message = CopyOnWrite(self.event)
+        granule = message.writable(['payload', 'granules', 1])
+        assert message.writable(['payload', 'granules', 1]) is granule
+        assert message.writable(['payload', 'missing']) is None
+        assert message.writable(['payload', 'granules', 5]) is None
+        granule['granuleId'] = 'g3'
+        assert message.document['payload']['granules'] == [{'granuleId': 'g1'},
+                                                           {'granuleId': 'g3'}]
+        assert message.document['payload']['granules'][0] is self.event['payload']['granules'][0]
+        assert self.event == self.original
+
+    def test_owned_documents_are_modified_in_place(self):
+        """ With owned=True nothing is copied """
+        message = CopyOnWrite(self.event, owned=True)
+        message.update(compile_path('$.meta.collection.name'), 'MOD11A1')
+        assert message.document is self.event
+        assert self.event['meta']['collection'] == {'name': 'MOD11A1'}
+
+    def test_update_and_writable_match(self):
+        """ Updates through simple paths copy the path, matches can be modified """
+        message = CopyOnWrite(self.event)
+        message.update(compile_path('$.payload.granules[0].granuleId'), 'g0')
+        message.writable_match(compile_path('$.meta.collection')).clear()
+        assert message.document == {
+            'meta': {'collection': {}, 'workflow_tasks': {}},
+            'payload': {'granules': [{'granuleId': 'g0'}, {'granuleId': 'g2'}]},
+        }
+        assert message.document['payload']['granules'][1] is self.event['payload']['granules'][1]
+        assert self.event == self.original
+
+    def test_materialize_deep_copies(self):
+        """ materialize makes the whole document writable at once """
+        message = CopyOnWrite(self.event)
+        message.materialize()
+        assert message.document == self.event
+        assert message.document['payload']['granules'][0] is not \
+            self.event['payload']['granules'][0]
+        assert message.writable(['payload']) is message.document['payload']
+
+    def test_assign_json_path_value_leaves_source_unchanged(self):
+        """ assign_json_path_value creates missing keys in the result only """
+        result = assign_json_path_value(self.event, '$.meta.new.key', 'value')
+        result = assign_json_path_value(result, '$.meta.collection.name', 'MOD11A1')
+        assert result['meta'] == {'collection': {'name': 'MOD11A1'}, 'workflow_tasks': {},
+                                  'new': {'key': 'value'}}
+        assert result['payload'] is self.event['payload']
+        assert self.event == self.original
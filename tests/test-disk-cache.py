@@ -0,0 +1,118 @@
+"""
+Tests for the message_adapter disk cache of remote events, against the local S3 stand-in
+"""
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+from message_adapter import aws, cumulus_message, disk_cache
+
+
+class StreamingBody(io.BytesIO):
+    """ Rejects negative sizes, like the StreamingBody of older botocore releases """
+
+    def read(self, size=None):
+        if size is not None and size < 0:
+            raise ValueError('negative count')
+        return super().read(size)
+
+
+class Test(unittest.TestCase):
+    """ Test class """
+    bucket_name = 'testing-disk-cache'
+
+    def setUp(self):
+        self.bucket = aws.s3().Bucket(self.bucket_name)
+        self.bucket.create()
+        self.directory = tempfile.mkdtemp()
+        self.environ = patch.dict(os.environ, {disk_cache.DIRECTORY_ENV_VAR: self.directory})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        shutil.rmtree(self.directory)
+        self.bucket.objects.all().delete()
+        self.bucket.delete()
+
+    def load(self, key):
+        """ Returns the payload of the remote event stored at key """
+        event = {'replace': {'Bucket': self.bucket_name, 'Key': key, 'TargetPath': '$.payload'},
+                 'payload': {}}
+        return cumulus_message.load_remote_event(event)['payload']
+
+    def entries(self):
+        """ Returns the names of the cache entries """
+        return sorted(os.listdir(self.directory))
+
+    def test_unchanged_objects_are_read_from_the_cache(self):
+        """ Cached objects are used while their ETag is unchanged """
+        self.bucket.Object('events/a').put(Body=json.dumps({'version': 1}))
+        assert self.load('events/a') == {'version': 1}
+        [entry] = self.entries()
+        assert entry.endswith('.identity')
+        # served from the cache, the object is not read again
+        with open(os.path.join(self.directory, entry), 'w') as cached_file:
+            cached_file.write(json.dumps({'version': 'cached'}))
+        assert self.load('events/a') == {'version': 'cached'}
+
+        self.bucket.Object('events/a').put(Body=json.dumps({'version': 2}))
+        assert self.load('events/a') == {'version': 2}
+        assert len(self.entries()) == 1 and self.entries() != [entry]
+
+    def test_objects_read_whole_are_cached(self):
+        """ read() without a size reads the whole body and caches it """
+        body = json.dumps({'granules': ['g1']}).encode('utf-8')
+        cache = disk_cache.get_cache()
+        data = {'Body': StreamingBody(body), 'ContentLength': len(body), 'ETag': '"abc"'}
+        reader = cache.reader(self.bucket_name, 'events/whole', data)
+        assert reader.read() == body
+        assert reader.read(-1) == b''
+        cached = cache.lookup(self.bucket_name, 'events/whole')
+        try:
+            assert cached.file.read() == body
+        finally:
+            cached.close()
+
+    def test_compressed_objects_are_cached_compressed(self):
+        """ Objects are cached as stored, along with their Content-Encoding """
+        body = gzip.compress(json.dumps({'granules': ['g1']}).encode('utf-8'))
+        self.bucket.Object('events/b').put(Body=body, ContentEncoding='gzip')
+        assert self.load('events/b') == {'granules': ['g1']}
+        assert self.load('events/b') == {'granules': ['g1']}
+        [entry] = self.entries()
+        assert entry.endswith('.gzip')
+        with open(os.path.join(self.directory, entry), 'rb') as cached_file:
+            assert cached_file.read() == body
+
+    def test_least_recently_used_objects_are_evicted(self):
+        """ The cache is bounded in bytes, evicting the least recently used objects """
+        body = json.dumps({'padding': 'x' * 1000})
+        for key in ('events/1', 'events/2', 'events/3'):
+            self.bucket.Object(key).put(Body=body)
+        with patch.dict(os.environ, {disk_cache.MAX_BYTES_ENV_VAR: str(2 * len(body))}):
+            self.load('events/1')
+            self.load('events/2')
+            time.sleep(0.01)
+            self.load('events/1')
+            self.load('events/3')
+            cache = disk_cache.get_cache()
+            assert cache.lookup(self.bucket_name, 'events/2') is None
+            for key in ('events/1', 'events/3'):
+                cache.lookup(self.bucket_name, key).close()
+        assert len(self.entries()) == 2
+
+    def test_partly_read_objects_are_not_cached(self):
+        """ Only objects read whole are moved into the cache """
+        self.bucket.Object('events/c').put(Body=b'{"a": 1}')
+        cache = disk_cache.get_cache()
+        data = self.bucket.Object('events/c').get()
+        reader = cache.reader(self.bucket_name, 'events/c', data)
+        assert reader.read(3) == b'{"a'
+        reader.close()
+        assert self.entries() == []
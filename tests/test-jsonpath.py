@@ -0,0 +1,159 @@
+"""
+Tests for message_adapter JSONPath handling
+"""
+import json
+import os
+import re
+import unittest
+
+from copy import deepcopy
+from jsonpath_ng import parse as jsonpath_ng_parse
+from message_adapter import jsonpath
+
+
+def collect_paths(document, prefix='$', depth=4):
+    """ Returns every simple child/index path that exists in a document, up to depth """
+    paths = [prefix]
+    if depth == 0:
+        return paths
+    if isinstance(document, dict):
+        for key, value in document.items():
+            if re.fullmatch(r'[a-zA-Z_][a-zA-Z0-9_]*', key):
+                paths += collect_paths(value, f'{prefix}.{key}', depth - 1)
+    elif isinstance(document, list):
+        for index, value in enumerate(document):
+            paths += collect_paths(value, f'{prefix}[{index}]', depth - 1)
+    return paths
+
+
+def collect_templates(document):
+    """ Returns the JSONPaths used by every template string in a document """
+    if isinstance(document, dict):
+        return [path for value in document.values() for path in collect_templates(value)]
+    if isinstance(document, list):
+        return [path for value in document for path in collect_templates(value)]
+    if isinstance(document, str):
+        return [match.strip('{}[]') for match in re.findall('{[^}]+}', document)]
+    return []
+
+
+def outcome(function, *args):
+    """ Returns what a call returns, or the type of the exception it raises """
+    try:
+        return function(*args)
+    except Exception as error:  # pylint: disable=broad-except
+        return type(error)
+
+
+def find_values(expression, document):
+    """ Returns the values a jsonpath_ng expression matches in a document """
+    return [match.value for match in expression.find(document)]
+
+
+def raised(function, *args):
+    """ Returns the type of the exception a call raises, None if it raises none """
+    try:
+        function(*args)
+    except Exception as error:  # pylint: disable=broad-except
+        return type(error)
+    return None
+
+
+class Test(unittest.TestCase):
+    # pylint: disable=protected-access
+    """ Test class """
+    test_folder = os.path.join(os.getcwd(), 'examples/messages')
+
+    def setUp(self):
+        jsonpath.cache_clear()
+
+    def example_messages(self):
+        """ Yields (filename, message) for every example message """
+        for filename in sorted(os.listdir(self.test_folder)):
+            with open(os.path.join(self.test_folder, filename)) as message:
+                yield filename, json.load(message)
+
+    def test_parse_caches_compiled_expressions(self):
+        """ The same path is compiled once and the compiled expression is shared """
+        first = jsonpath.parse('$.meta[*].collection')
+        second = jsonpath.parse('$.meta[*].collection')
+        assert first is second
+        info = jsonpath.parse.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+    def test_compile_path_caches_compiled_paths(self):
+        """ compile_path returns the same object for the same path and counts hits """
+        assert jsonpath.compile_path('$.meta.collection') is \
+            jsonpath.compile_path('$.meta.collection')
+        info = jsonpath.cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+    def test_cached_expression_finds_and_updates(self):
+        """ A cached path can be reused against different messages """
+        message = {'meta': {'collection': 'MOD09GQ'}}
+        for path in ('$.meta.collection', '$.meta[*].collection'):
+            for _ in range(2):
+                assert jsonpath.compile_path(path).find(message) == ['MOD09GQ']
+        jsonpath.compile_path('$.meta.collection').update(message, 'MOD11A1')
+        assert message == {'meta': {'collection': 'MOD11A1'}}
+
+    def test_cache_is_bounded(self):
+        """ The least recently used paths are evicted once the cache is full """
+        maxsize = jsonpath.cache_info().maxsize
+        for index in range(maxsize + 10):
+            jsonpath.compile_path(f'$.meta.key{index}')
+        assert jsonpath.cache_info().currsize == maxsize
+
+    def test_simple_paths_use_fast_path(self):
+        """ Child and index paths are evaluated natively, other paths by jsonpath_ng """
+        for path in ('$', '$.meta.foo', 'meta.foo', '$.payload.granules[0].files'):
+            assert isinstance(jsonpath.compile_path(path), jsonpath.SimplePath), path
+        for path in ('$..foo', '$.meta[*]', '$.meta.*', "$['meta']", '$.payload[-1]'):
+            assert isinstance(jsonpath.compile_path(path), jsonpath.ExpressionPath), path
+        # a reserved word, which jsonpath_ng does not parse as a field either
+        assert jsonpath._compile_simple_path('$.meta.where') is None
+
+    def test_fast_path_matches_jsonpath_ng_on_examples(self):
+        """
+        For every example message, every path it contains or templates, and a set of
+        missing paths, SimplePath find/update/str agree with jsonpath_ng, down to the
+        exception raised for an index of an object
+        """
+        extra_paths = ['$.missing', '$.meta.missing.deeper', '$.payload[99]', '$.meta[0]',
+                       '$.payload.input.anykey[0]', 'meta.foo', 'payload']
+        for filename, message in self.example_messages():
+            paths = set(collect_paths(message) + collect_templates(message) + extra_paths)
+            for path in sorted(paths):
+                simple_path = jsonpath._compile_simple_path(path)
+                if simple_path is None:
+                    continue
+                expression = jsonpath_ng_parse(path)
+                expected = outcome(find_values, expression, message)
+                self.assertEqual(outcome(simple_path.find, message), expected, (filename, path))
+                self.assertEqual(str(simple_path), str(expression), (filename, path))
+
+                updated, expected_update = deepcopy(message), deepcopy(message)
+                self.assertEqual(raised(simple_path.update, updated, 'updated value'),
+                                 raised(expression.update, expected_update, 'updated value'),
+                                 (filename, path))
+                self.assertEqual(updated, expected_update, (filename, path))
+
+    def test_path_set_matches_jsonpath_ng_on_examples(self):
+        """ A PathSet of every path of an example message resolves them as jsonpath_ng does """
+        extra_paths = ['$.missing', '$.payload[99]', '$.meta[*].foo', '$..foo']
+        for filename, message in self.example_messages():
+            paths = sorted(set(collect_paths(message) + collect_templates(message) +
+                               extra_paths))
+            found = jsonpath.PathSet([jsonpath.compile_path(path) for path in paths]).find(message)
+            for path in paths:
+                expected = [match.value for match in jsonpath_ng_parse(path).find(message)]
+                self.assertEqual(found.get(jsonpath.compile_path(path), []), expected,
+                                 (filename, path))
+
+    def test_path_set_raises_as_jsonpath_ng_does(self):
+        """ An index of an object raises the exception jsonpath_ng raises for it """
+        message = {'meta': {'collection': 'MOD09GQ'}}
+        path_set = jsonpath.PathSet([jsonpath.compile_path('$.meta.collection'),
+                                     jsonpath.compile_path('$.meta[0]')])
+        expected = raised(find_values, jsonpath_ng_parse('$.meta[0]'), message)
+        self.assertEqual(raised(path_set.find, message), expected)
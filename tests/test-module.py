@@ -6,7 +6,7 @@ import json
 import unittest
 from mock import patch
 from jsonschema.exceptions import ValidationError
-from message_adapter import aws, message_adapter
+from message_adapter import aws, codec, compression, cumulus_message, message_adapter
 
 
 class Test(unittest.TestCase):  # pylint: disable=too-many-public-methods
@@ -67,6 +67,19 @@ class Test(unittest.TestCase):  # pylint: disable=too-many-public-methods
             self.event_with_replace, None)
         assert result == self.s3_object
 
+    def test_streams_remote_s3_object(self):
+        """ Remote events are streamed, those the streaming parser rejects are read whole """
+        self.s3.Object(self.bucket_name, self.config_key_name).put(
+            Body='{"input": ":blue_whale:", "size": NaN}')
+        event = {'replace': {'Bucket': self.bucket_name, 'Key': self.config_key_name,
+                             'TargetPath': '$'}}
+        with patch.dict(os.environ, {'CMA_JSON_STREAM_MIN_SIZE': '0'}):
+            assert self.cumulus_message_adapter.load_and_update_remote_event(
+                self.event_with_replace, None) == self.s3_object
+            result = self.cumulus_message_adapter.load_and_update_remote_event(event, None)
+        assert result['input'] == ':blue_whale:'
+        assert result['size'] != result['size']
+
     def test_returns_event(self):
         """ Test event argument is returned when 'replace' key is not present """
         result = self.cumulus_message_adapter.load_and_update_remote_event(
@@ -395,6 +408,104 @@ class Test(unittest.TestCase):  # pylint: disable=too-many-public-methods
         self.assertEqual(remote_event_object, expected_remote_event_object)
         self.assertEqual(create_next_event_result, expected_create_next_event_result)
 
+    @patch('uuid.uuid4')
+    def test_big_result_stored_compressed(self, uuid_mock):
+        """
+        Test remote event is compressed with ReplaceConfig.ContentEncoding and
+        decompressed when it is loaded again
+        """
+        uuid_mock.return_value = self.test_uuid
+        for content_encoding in ('gzip', 'zstd'):
+            try:
+                encoding = compression.get_encoding(content_encoding)
+            except ImportError:
+                continue
+            event_with_ingest = {
+                'cumulus_meta': {
+                    'workflow': 'testing',
+                    'system_bucket': self.bucket_name
+                },
+                'meta': {'collection': 'MOD09GQ'},
+                'ReplaceConfig': {
+                    'Path': '$.payload',
+                    'MaxSize': 1,
+                    'ContentEncoding': content_encoding,
+                    'CompressionLevel': 1
+                }
+            }
+            create_next_event_result = self.cumulus_message_adapter.create_next_event(
+                self.nested_response, event_with_ingest, None)
+            assert create_next_event_result['replace'] == {
+                'Bucket': self.bucket_name, 'Key': self.next_event_object_key_name,
+                'TargetPath': '$.payload'}
+
+            remote_event = self.s3.Object(self.bucket_name, self.next_event_object_key_name).get()
+            self.assertEqual(remote_event['ContentEncoding'], content_encoding)
+            content = encoding.open(remote_event['Body']).read()
+            self.assertEqual(json.loads(content), self.nested_response)
+            self.assertEqual(remote_event['Metadata'],
+                             {compression.UNCOMPRESSED_LENGTH_METADATA: str(len(content))})
+
+            # objects small once decompressed are read whole, not streamed
+            with patch.object(codec, '_build', side_effect=AssertionError('streamed')):
+                result = self.cumulus_message_adapter.load_and_update_remote_event(
+                    create_next_event_result, None)
+            self.assertEqual(result['payload'], self.nested_response)
+            self.assertEqual(result['meta'], {'collection': 'MOD09GQ'})
+
+    def test_compressed_remote_event_without_length_is_streamed(self):
+        """ Compressed objects stored without their uncompressed size are streamed """
+        body = compression.Gzip.compress(json.dumps(self.nested_response).encode('utf-8'))
+        self.s3.Object(self.bucket_name, self.config_key_name).put(
+            Body=body, ContentEncoding='gzip')
+        event = {'replace': {'Bucket': self.bucket_name, 'Key': self.config_key_name,
+                             'TargetPath': '$'}}
+        with patch.object(codec, '_build', wraps=codec._build) as build:
+            result = self.cumulus_message_adapter.load_and_update_remote_event(event, None)
+        self.assertEqual(result, self.nested_response)
+        try:
+            import ijson  # pylint: disable=unused-import,import-outside-toplevel
+        except ImportError:
+            return
+        build.assert_called_once()
+
+    def test_content_addressed_result_stored_once(self):
+        """
+        Test identical remote events stored with ReplaceConfig.ContentAddressed share one
+        object named after their content
+        """
+        event_with_ingest = {
+            'cumulus_meta': {
+                'workflow': 'testing',
+                'system_bucket': self.bucket_name
+            },
+            'ReplaceConfig': {
+                'Path': '$.payload',
+                'MaxSize': 1,
+                'ContentAddressed': True
+            }
+        }
+        results = [self.cumulus_message_adapter.create_next_event(
+            self.nested_response, event_with_ingest, None) for _ in range(2)]
+        key = results[0]['replace']['Key']
+        assert key.startswith('events/sha256-')
+        assert results[1]['replace']['Key'] == key
+        try:
+            result = self.cumulus_message_adapter.load_and_update_remote_event(results[1], None)
+            self.assertEqual(result['payload'], self.nested_response)
+        finally:
+            self.s3.Object(self.bucket_name, key).delete()
+
+    def test_unknown_content_encoding(self):
+        """ Test an unknown ReplaceConfig.ContentEncoding is rejected """
+        event_with_ingest = {
+            'cumulus_meta': {'system_bucket': self.bucket_name},
+            'ReplaceConfig': {'FullMessage': True, 'ContentEncoding': 'rot13'}
+        }
+        with self.assertRaises(LookupError):
+            self.cumulus_message_adapter.create_next_event(
+                self.nested_response, event_with_ingest, None)
+
     def test_basic(self):
         """ test basic.input.json """
         inp = open(os.path.join(self.test_folder, 'basic.input.json'))
@@ -545,6 +656,35 @@ class Test(unittest.TestCase):  # pylint: disable=too-many-public-methods
         self.s3.Bucket(bucket_name).delete()
         self.assertEqual(result, out_msg)
 
+    def test_messages_are_not_modified(self):
+        """
+        The input message, the loaded event and the handler response are left unchanged
+        while the next message is built from them
+        """
+        with open(os.path.join(self.test_folder, 'configured_remote.input.json')) as inp:
+            in_msg = json.load(inp)
+        bucket_name = in_msg['cma']['event']['replace']['Bucket']
+        key_name = in_msg['cma']['event']['replace']['Key']
+        with open(os.path.join(self.test_folder, key_name)) as file_data:
+            datasource = json.load(file_data)
+        self.s3.Bucket(bucket_name).create()
+        self.s3.Object(bucket_name, key_name).put(Body=json.dumps(datasource))
+
+        in_msg_copy = json.loads(json.dumps(in_msg))
+        remote_event = self.cumulus_message_adapter.load_and_update_remote_event(in_msg, {})
+        remote_event_copy = json.loads(json.dumps(remote_event))
+        msg = self.cumulus_message_adapter.load_nested_event(remote_event, {})
+        message_config = msg.pop('messageConfig', None)
+        msg_copy = json.loads(json.dumps(msg))
+        result = self.cumulus_message_adapter.create_next_event(msg, remote_event, message_config)
+        result['payload'] = {'changed': True}
+
+        self.s3.Bucket(bucket_name).delete_objects(Delete={'Objects': [{'Key': key_name}]})
+        self.s3.Bucket(bucket_name).delete()
+        self.assertEqual(in_msg, in_msg_copy)
+        self.assertEqual(remote_event, remote_event_copy)
+        self.assertEqual(msg, msg_copy)
+
     @patch.object(message_adapter, 'get_current_sfn_task')
     def test_sfn(self, get_current_sfn_task_function):
         """ test sfn.input.json """
@@ -580,6 +720,50 @@ class Test(unittest.TestCase):  # pylint: disable=too-many-public-methods
         result = self.cumulus_message_adapter.create_next_event(msg, in_msg, message_config)
         assert result == out_msg
 
+    @patch.object(cumulus_message, 'get_current_sfn_task')
+    @patch.object(message_adapter, 'get_current_sfn_task')
+    def test_task_name_from_message(self, get_current_sfn_task_function,
+                                    load_config_sfn_task_function):
+        """ A task name supplied in the cma block spares the step function API lookups """
+        with open(os.path.join(self.test_folder, 'context.input.json')) as inp:
+            event = json.load(inp)
+        with open(os.path.join(self.context_folder, 'lambda-context.json')) as ctx:
+            context = dict(json.load(ctx), aws_request_id='request-1')
+        event['workflow_config'] = {'FromMessage': event.pop('task_config')}
+        in_msg = {'cma': {'event': event, cumulus_message.TASK_NAME_KEY: 'FromMessage'}}
+        aws.task_name_cache_clear()
+
+        rem = self.cumulus_message_adapter.load_and_update_remote_event(in_msg, context)
+        msg = self.cumulus_message_adapter.load_nested_event(rem, context)
+        message_config = msg.pop('messageConfig', None)
+        result = self.cumulus_message_adapter.create_next_event(msg, rem, message_config)
+
+        get_current_sfn_task_function.assert_not_called()
+        load_config_sfn_task_function.assert_not_called()
+        # one invocation, counted once
+        assert aws.task_name_source_counts() == {'message': 1}
+        assert msg['config'] == {'inlinestr': 'prefixbarsuffix', 'array': ['bar'],
+                                 'object': {'foo': 0}}
+        assert rem['meta']['workflow_tasks'] == {'FromMessage': {
+            'name': 'fakeStep', 'version': 1,
+            'arn': 'arn:aws:lambda:us-east-1:123:function:fakeStep:1'}}
+        assert cumulus_message.TASK_NAME_KEY not in result
+
+    @patch.object(message_adapter, 'get_current_sfn_task')
+    def test_message_task_name_field_is_not_reserved(self, get_current_sfn_task_function):
+        """ A task_name of the message itself is kept and does not name the task """
+        get_current_sfn_task_function.return_value = 'Example'
+        with open(os.path.join(self.test_folder, 'context.input.json')) as inp:
+            event = json.load(inp)
+        with open(os.path.join(self.context_folder, 'lambda-context.json')) as ctx:
+            context = json.load(ctx)
+        event['task_name'] = 'granule-task'
+        rem = self.cumulus_message_adapter.load_and_update_remote_event(event, context)
+        get_current_sfn_task_function.assert_called_once()
+        assert list(rem['meta']['workflow_tasks']) == ['Example']
+        result = self.cumulus_message_adapter.create_next_event({}, rem, None)
+        assert result['task_name'] == 'granule-task'
+
     @patch.object(message_adapter, 'get_current_sfn_task')
     def test_inline_template(self, get_current_sfn_task_function):
         """ test inline_template.input.json """
@@ -596,6 +780,28 @@ class Test(unittest.TestCase):  # pylint: disable=too-many-public-methods
         result = self.cumulus_message_adapter.create_next_event(msg, in_msg, message_config)
         assert result == out_msg
 
+    @patch.object(message_adapter, 'get_current_sfn_task')
+    def test_prepare(self, get_current_sfn_task_function):
+        """ test prepare returns the full and nested events and looks up the task once """
+        get_current_sfn_task_function.return_value = "Example"
+        inp = open(os.path.join(self.test_folder, 'context.input.json'))
+        ctx = open(os.path.join(self.context_folder, 'lambda-context.json'))
+        in_msg = json.loads(inp.read())
+        context = json.loads(ctx.read())
+        in_msg['workflow_config'] = {'Example': in_msg.pop('task_config')}
+
+        result = self.cumulus_message_adapter.prepare(in_msg, context)
+
+        assert get_current_sfn_task_function.call_count == 1
+        assert result['event']['meta']['workflow_tasks']['Example']['name'] == 'fakeStep'
+        assert result['nested_event'] == {
+            'input': {'anykey': 'anyvalue'},
+            'config': {'inlinestr': 'prefixbarsuffix', 'array': ['bar'],
+                       'object': {'foo': 0}},
+            'cumulus_config': {'state_machine': in_msg['cumulus_meta']['state_machine'],
+                               'execution_name': in_msg['cumulus_meta']['execution_name']}
+        }
+
     def test_templates(self):
         """ test templates.input.json """
         inp = open(os.path.join(self.test_folder, 'templates.input.json'))
@@ -0,0 +1,75 @@
+"""
+Tests for message_adapter compiled outputs
+"""
+import io
+import unittest
+
+from copy import deepcopy
+from contextlib import redirect_stderr
+from message_adapter import outputs
+from message_adapter.template import compile_template
+from message_adapter.copy_on_write import CopyOnWrite
+from message_adapter.util import assign_json_path_value
+
+
+def assign_one_by_one(event, handler_response, output_list):
+    """ Assigns outputs the way they were assigned before output plans """
+    result = deepcopy(event)
+    for output in output_list:
+        template = compile_template(output['source'])
+        value = template.resolve(handler_response) if template else output['source']
+        result = assign_json_path_value(result, output['destination'].strip('{}'), value)
+    return result
+
+
+class Test(unittest.TestCase):
+    """ Test class """
+    event = {'meta': {'foo': 'bar', 'nested': {'a': 1}}, 'payload': {}, 'exception': 'None'}
+    handler_response = {'input': {'anykey': 'anyvalue', 'list': [1, 2]}, 'other': 'x'}
+
+    def setUp(self):
+        outputs.cache_clear()
+
+    def apply(self, output_list):
+        """ Returns the event with the outputs applied through an output plan """
+        message = CopyOnWrite(self.event)
+        with redirect_stderr(io.StringIO()):
+            outputs.compile_outputs(output_list).apply(message, self.handler_response)
+        return message.document
+
+    def test_outputs_match_one_by_one_assignment(self):
+        """ An output plan produces the message assigning each output in turn produced """
+        cases = [
+            [{'source': '{$}', 'destination': '{$.payload}'},
+             {'source': '{$.input.anykey}', 'destination': '{$.meta.baz}'}],
+            [{'source': '{$.input.list}', 'destination': '{$.meta.new.deeper.key}'},
+             {'source': '{[$.input.list]}', 'destination': '{$.meta.nested.a}'}],
+            [{'source': 'constant', 'destination': '{$.payload.out}'},
+             {'source': 'value {$.other}', 'destination': '{meta.foo}'},
+             {'source': '{$.missing}', 'destination': '{$.meta.missing}'}],
+            [{'source': '{$.input}', 'destination': '{$.payload}'},
+             {'source': '{$.other}', 'destination': '{$.payload.extra}'}],
+            [{'source': '{$.other}', 'destination': '{$}'}],
+        ]
+        for output_list in cases:
+            expected = assign_one_by_one(self.event, self.handler_response, output_list)
+            self.assertEqual(self.apply(output_list), expected, output_list)
+        assert self.event == {'meta': {'foo': 'bar', 'nested': {'a': 1}}, 'payload': {},
+                              'exception': 'None'}
+        assert self.handler_response == {'input': {'anykey': 'anyvalue', 'list': [1, 2]},
+                                         'other': 'x'}
+
+    def test_conflicts_are_reported(self):
+        """ Destinations inside other destinations are reported once, when compiled """
+        output_list = [{'source': '{$.input.anykey}', 'destination': '{$.payload.out}'},
+                       {'source': '{$.input}', 'destination': '{$.payload}'},
+                       {'source': '{$.other}', 'destination': '{$.meta.other}'},
+                       {'source': '{$.other}', 'destination': '{$.meta.other}'}]
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            plan = outputs.compile_outputs(output_list)
+            outputs.compile_outputs(output_list)
+        assert plan.conflicts == [('$.payload', '$.payload.out'),
+                                  ('$.meta.other', '$.meta.other')]
+        assert stderr.getvalue().count('warning') == 2
+        assert outputs.cache_info().hits == 1
@@ -82,12 +82,36 @@ class Test(unittest.TestCase):
         p_stdin.write('<EOC>\n'.encode('utf-8'))
         p_stdin.flush()
 
-    def transform_messages_streaming(self, testcase, context=None):
+    def read_framed_output(self, stream_process):
         """
-        Given a testcase, run 'streaming' interface against input and check if outputs are correct
+        Given a subprocess, read one length-prefixed <RESULT> frame from its stdout
+        """
+        header = stream_process.stdout.readline().decode('ascii').split()
+        if len(header) != 2 or header[0] != '<RESULT>':
+            err_string = ''.join([x.decode('utf-8') for x in stream_process.stderr.readlines()])
+            raise Exception(err_string)
+        return json.loads(stream_process.stdout.read(int(header[1])))
+
+    def write_framed_input(self, command, proc_input, p_stdin):
+        """
+        Given a stdin pipe for a subprocess, write a length-prefixed command frame
+        """
+        payload = json.dumps(proc_input).encode('utf-8')
+        p_stdin.write(f'{command} {len(payload)}\n'.encode('ascii'))
+        p_stdin.write(payload)
+        p_stdin.flush()
+
+    def transform_messages_streaming(self, testcase, context=None, framed=False, session=False):
+        """
+        Given a testcase, run 'streaming' interface against input and check if outputs are correct.
+        With session set, the resolved event is kept in the CMA process and referred to by handle
         """
         if context is None:
             context = {}
+        if framed:
+            write_input, read_output = self.write_framed_input, self.read_framed_output
+        else:
+            write_input, read_output = self.write_streaming_input, self.read_streaming_output
 
         inp = open(os.path.join(self.test_folder, f'{testcase}.input.json'))
         in_msg = json.loads(inp.read())
@@ -105,21 +129,29 @@ class Test(unittest.TestCase):
         stream_process = subprocess.Popen(['python', current_directory, 'stream'],
                                           stdin=subprocess.PIPE, stdout=subprocess.PIPE,
                                           stderr=subprocess.PIPE)
-        self.write_streaming_input('loadAndUpdateRemoteEvent', cma_input, stream_process.stdin)
-        load_and_update_remote_event_response = self.read_streaming_output(stream_process)
-        cma_input = {'event': load_and_update_remote_event_response, 'context': context,
-                     'schemas': schemas}
-        self.write_streaming_input('loadNestedEvent', cma_input, stream_process.stdin)
-        load_nested_event_response = self.read_streaming_output(stream_process)
+        if framed:
+            stream_process.stdin.write('<FRAMED>\n'.encode('utf-8'))
+            stream_process.stdin.flush()
+            assert stream_process.stdout.readline() == b'<FRAMED>\n'
+        if session:
+            cma_input['session'] = True
+        write_input('loadAndUpdateRemoteEvent', cma_input, stream_process.stdin)
+        load_and_update_remote_event_response = read_output(stream_process)
+        if session:
+            event_or_session = {'session': load_and_update_remote_event_response['session']}
+        else:
+            event_or_session = {'event': load_and_update_remote_event_response}
+        cma_input = {**event_or_session, 'context': context, 'schemas': schemas}
+        write_input('loadNestedEvent', cma_input, stream_process.stdin)
+        load_nested_event_response = read_output(stream_process)
 
         message_config = load_nested_event_response.get('messageConfig')
         if 'messageConfig' in load_nested_event_response:
             del load_nested_event_response['messageConfig']
-        cma_input = {'handler_response': load_nested_event_response,
-                     'event': load_and_update_remote_event_response,
+        cma_input = {**event_or_session, 'handler_response': load_nested_event_response,
                      'message_config': message_config, 'schemas': schemas}
-        self.write_streaming_input('createNextEvent', cma_input, stream_process.stdin)
-        create_next_event_response = self.read_streaming_output(stream_process)
+        write_input('createNextEvent', cma_input, stream_process.stdin)
+        create_next_event_response = read_output(stream_process)
 
         stream_process.stdin.write('<EXIT>\n'.encode('utf-8'))
         stream_process.stdin.flush()
@@ -188,31 +220,73 @@ class Test(unittest.TestCase):
         """ test basic message """
         self.transform_messages('basic')
         self.transform_messages_streaming('basic')
+        self.transform_messages_streaming('basic', framed=True)
+        self.transform_messages_streaming('basic', framed=True, session=True)
 
     def test_exception(self):
         """ test remote message with exception """
         self.transform_messages('exception')
         self.transform_messages_streaming('exception')
+        self.transform_messages_streaming('exception', framed=True)
 
     def test_jsonpath(self):
         """ test jsonpath message """
         self.transform_messages('jsonpath')
         self.transform_messages_streaming('jsonpath')
+        self.transform_messages_streaming('jsonpath', framed=True)
 
     def test_meta(self):
         """ test meta message """
         self.transform_messages('meta')
         self.transform_messages_streaming('meta')
+        self.transform_messages_streaming('meta', framed=True)
 
     def test_remote(self):
         """ test remote message """
         self.transform_messages('remote')
         self.transform_messages_streaming('remote')
+        self.transform_messages_streaming('remote', framed=True)
+        self.transform_messages_streaming('remote', framed=True, session=True)
 
     def test_templates(self):
         """ test templates message """
         self.transform_messages('templates')
         self.transform_messages_streaming('templates')
+        self.transform_messages_streaming('templates', framed=True)
+        self.transform_messages_streaming('templates', framed=True, session=True)
+
+    def test_pipelined_streaming(self):
+        """ test concurrent, request-id tagged stream commands """
+        testcases = ['basic', 'jsonpath', 'meta', 'templates']
+        stream_process = subprocess.Popen(['python', os.getcwd(), 'stream'],
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.PIPE)
+        stream_process.stdin.write('<PIPELINED> 4\n'.encode('utf-8'))
+        stream_process.stdin.flush()
+        assert stream_process.stdout.readline() == b'<PIPELINED>\n'
+
+        expected = {}
+        for testcase in testcases:
+            with open(os.path.join(self.test_folder, f'{testcase}.input.json')) as inp:
+                expected[testcase] = json.load(inp)
+            payload = json.dumps({'event': expected[testcase], 'context': {}}).encode('utf-8')
+            stream_process.stdin.write(
+                f'loadAndUpdateRemoteEvent {testcase} {len(payload)}\n'.encode('ascii'))
+            stream_process.stdin.write(payload)
+        stream_process.stdin.write('loadNestedEvent failing 2\n{}'.encode('ascii'))
+        stream_process.stdin.write('<EXIT>\n'.encode('utf-8'))
+        stream_process.stdin.flush()
+
+        responses = {}
+        for _ in range(len(testcases) + 1):
+            status, request_id, length = stream_process.stdout.readline().decode('ascii').split()
+            responses[request_id] = (status, json.loads(stream_process.stdout.read(int(length))))
+        assert stream_process.wait(20) == 0
+
+        for testcase in testcases:
+            assert responses[testcase] == ('<RESULT>', expected[testcase])
+        assert responses['failing'][0] == '<ERROR>'
+        assert responses['failing'][1]['error'] == 'KeyError'
 
     def test_validation_failure_case(self):
         """ test validation failure case """
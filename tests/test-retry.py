@@ -0,0 +1,128 @@
+"""
+Tests for message_adapter retries and circuit breaker
+"""
+import unittest
+
+from mock import patch
+from message_adapter.retry import CircuitBreaker, CircuitOpenError, RetryPolicy, is_retryable
+
+
+class FakeClientError(Exception):
+    """ An error shaped like botocore's ClientError """
+
+    def __init__(self, code, status=400):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}
+
+
+class EndpointConnectionError(Exception):
+    """ Named like botocore's connection error """
+
+
+class FakeClock:
+    """ A timer whose sleep advances time """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def timer(self):
+        """ Returns the current time """
+        return self.now
+
+    def sleep(self, delay):
+        """ Advances the time by delay """
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+class Flaky:  # pylint: disable=too-few-public-methods
+    """ Raises the given errors, one per call, then returns 'ok' """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class Test(unittest.TestCase):
+    """ Test class """
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def policy(self, max_attempts=5, deadline=60, breaker=None):
+        """ Returns a policy that sleeps on the fake clock """
+        return RetryPolicy(max_attempts, 1, 8, deadline, breaker=breaker,
+                           sleep=self.clock.sleep, timer=self.clock.timer)
+
+    def test_errors_are_classified(self):
+        """ Throttling, 5xx and connection errors are retryable, other errors are not """
+        assert is_retryable(FakeClientError('ThrottlingException'))
+        assert is_retryable(FakeClientError('InternalFailure', 500))
+        assert is_retryable(EndpointConnectionError())
+        assert not is_retryable(FakeClientError('ExecutionDoesNotExist'))
+        assert not is_retryable(KeyError('events'))
+
+    def test_retries_with_jittered_backoff(self):
+        """ Retryable errors are retried after delays bounded by the exponential backoff """
+        flaky = Flaky(FakeClientError('ThrottlingException'), EndpointConnectionError(),
+                      FakeClientError('ThrottlingException'))
+        assert self.policy().call(flaky) == 'ok'
+        assert flaky.calls == 4
+        assert [delay <= bound for (delay, bound) in zip(self.clock.sleeps, [1, 2, 4])] == \
+            [True, True, True]
+
+    def test_other_errors_are_raised_at_once(self):
+        """ Errors that are not retryable are not retried """
+        flaky = Flaky(FakeClientError('ExecutionDoesNotExist'))
+        with self.assertRaises(FakeClientError):
+            self.policy().call(flaky)
+        assert flaky.calls == 1
+
+    @patch('random.uniform', side_effect=lambda low, high: high)
+    def test_attempts_and_deadline_are_bounded(self, _uniform):
+        """ The last error is raised once attempts or time run out """
+        flaky = Flaky(*[FakeClientError('ThrottlingException')] * 10)
+        with self.assertRaises(FakeClientError):
+            self.policy(max_attempts=3).call(flaky)
+        assert flaky.calls == 3
+        assert self.clock.sleeps == [1, 2]
+
+        # with the longest delays the next retry, 8 seconds after 15, would end after the
+        # deadline
+        self.clock.sleeps = []
+        flaky = Flaky(*[FakeClientError('ThrottlingException')] * 100)
+        with self.assertRaises(FakeClientError):
+            self.policy(max_attempts=100, deadline=20).call(flaky)
+        assert flaky.calls == 5
+        assert self.clock.sleeps == [1, 2, 4, 8]
+
+    def test_circuit_breaker(self):
+        """ The breaker opens after consecutive failures, fails fast, then lets a call through """
+        breaker = CircuitBreaker('Test', 4, 30, timer=self.clock.timer)
+        policy = self.policy(max_attempts=2, breaker=breaker)
+        for _ in range(2):
+            with self.assertRaises(FakeClientError):
+                policy.call(Flaky(*[FakeClientError('ThrottlingException')] * 2))
+        flaky = Flaky()
+        with self.assertRaises(CircuitOpenError) as context:
+            policy.call(flaky)
+        assert 'Test circuit breaker is open' in str(context.exception)
+        assert isinstance(context.exception, LookupError)
+        assert flaky.calls == 0
+
+        self.clock.now += 30
+        with self.assertRaises(FakeClientError):
+            policy.call(Flaky(FakeClientError('ThrottlingException')))
+        with self.assertRaises(CircuitOpenError):
+            policy.call(flaky)
+
+        self.clock.now += 30
+        assert policy.call(flaky) == 'ok'
+        assert breaker.failures == 0
@@ -0,0 +1,149 @@
+"""
+Tests for the message_adapter cached JSON schema validators
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+from jsonschema import validate
+from jsonschema.exceptions import SchemaError, ValidationError
+from message_adapter import schemas
+
+
+class Test(unittest.TestCase):
+    """ Test class """
+
+    def setUp(self):
+        schemas.cache_clear()
+        self.folder = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.folder, 'input.json')
+        self.write_schema('{"type": "object", "properties": {"name": {"type": "string"}}}')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+        schemas.cache_clear()
+
+    def write_schema(self, schema, mtime_ns=None):
+        """ writes the test schema file """
+        with open(self.filepath, 'w') as schema_file:
+            schema_file.write(schema)
+        if mtime_ns is not None:
+            os.utime(self.filepath, ns=(mtime_ns, mtime_ns))
+
+    def test_validators_are_cached(self):
+        """ A schema file is read once while it is unchanged """
+        validator = schemas.load_validator(self.filepath)
+        assert schemas.load_validator(self.filepath) is validator
+        assert schemas.load_validator(os.path.join(self.folder, '.', 'input.json')) is validator
+        validator.validate({'name': 'granule'})
+        assert schemas.cache_info().hits == 2
+        assert schemas.cache_info().misses == 1
+
+    def test_modified_schemas_are_reloaded(self):
+        """ The modification time is part of the cache key """
+        validator = schemas.load_validator(self.filepath)
+        self.write_schema('{"type": "array"}', mtime_ns=os.stat(self.filepath).st_mtime_ns + 10**9)
+        reloaded = schemas.load_validator(self.filepath)
+        assert reloaded is not validator
+        reloaded.validate([])
+        with self.assertRaises(ValidationError):
+            reloaded.validate({})
+
+    def test_errors_match_jsonschema_validate(self):
+        """ Invalid documents raise the error jsonschema.validate raises """
+        document = {'name': 1}
+        with self.assertRaises(ValidationError) as expected:
+            validate(document, {'type': 'object',
+                                'properties': {'name': {'type': 'string'}}})
+        with self.assertRaises(ValidationError) as raised:
+            schemas.load_validator(self.filepath).validate(document)
+        assert str(raised.exception) == str(expected.exception)
+
+    def test_invalid_schemas_raise_on_every_validation(self):
+        """ A schema that is not valid raises SchemaError, as jsonschema.validate does """
+        self.write_schema('{"type": 12}')
+        validator = schemas.load_validator(self.filepath)
+        for _ in range(2):
+            with self.assertRaises(SchemaError):
+                validator.validate({})
+
+    def test_codegen_errors_match_jsonschema_validate(self):
+        """ The codegen engine accepts valid documents and raises jsonschema's errors """
+        validator = schemas.load_validator(self.filepath, 'codegen')
+        assert validator is not schemas.load_validator(self.filepath, 'jsonschema')
+        validator.validate({'name': 'granule'})
+        with self.assertRaises(ValidationError) as expected:
+            schemas.load_validator(self.filepath, 'jsonschema').validate({'name': 1})
+        with self.assertRaises(ValidationError) as raised:
+            validator.validate({'name': 1})
+        assert str(raised.exception) == str(expected.exception)
+
+    def test_codegen_code_is_cached_next_to_the_schema(self):
+        """ Generated code is written next to the schema and reused by later processes """
+        self.write_schema('{"$schema": "http://json-schema.org/draft-04/schema#", '
+                          '"type": "array", "items": {"type": "integer"}}')
+        with patch.dict(os.environ, {schemas.ENGINE_ENV_VAR: 'codegen'}):
+            schemas.load_validator(self.filepath).validate([1, 2])
+        code_files = [name for name in os.listdir(self.folder) if name != 'input.json']
+        assert len(code_files) == 1
+        assert code_files[0].startswith('.input.json.') and code_files[0].endswith('.py')
+        schemas.cache_clear()
+        with patch('fastjsonschema.compile_to_code') as compile_to_code:
+            validator = schemas.load_validator(self.filepath, 'codegen')
+            validator.validate([3])
+            with self.assertRaises(ValidationError):
+                validator.validate([1.5])
+        compile_to_code.assert_not_called()
+
+    def test_codegen_untrusted_code_is_not_executed(self):
+        """ Cached code not matching its digest, or writable by others, is generated again """
+        self.write_schema('{"$schema": "http://json-schema.org/draft-07/schema#", '
+                          '"type": "object", "properties": {"name": {"type": "string"}}}')
+        with patch.dict(os.environ, {schemas.ENGINE_ENV_VAR: 'codegen'}):
+            schemas.load_validator(self.filepath).validate({'name': 'granule'})
+        [code_file] = [name for name in os.listdir(self.folder) if name != 'input.json']
+        code_path = os.path.join(self.folder, code_file)
+        with open(code_path, encoding='utf-8') as generated:
+            header, code = generated.read().split('\n', 1)
+        for content, mode in ((f'{header}\nraise AssertionError("executed")\n', 0o600),
+                              (f'{header}\n{code}', 0o666)):
+            with open(code_path, 'w', encoding='utf-8') as generated:
+                generated.write(content)
+            os.chmod(code_path, mode)
+            schemas.cache_clear()
+            validator = schemas.load_validator(self.filepath, 'codegen')
+            validator.validate({'name': 'granule'})
+            with self.assertRaises(ValidationError):
+                validator.validate({'name': 1})
+            # replaced by newly generated code
+            with open(code_path, encoding='utf-8') as generated:
+                assert generated.read() == f'{header}\n{code}'
+            assert os.stat(code_path).st_mode & 0o022 == 0
+
+    def test_codegen_unsupported_drafts_use_jsonschema(self):
+        """ Schemas fastjsonschema cannot compile are validated by jsonschema """
+        self.write_schema('{"$schema": "http://json-schema.org/draft-03/schema#", '
+                          '"type": "object", "properties": {"name": {"type": "string"}}}')
+        validator = schemas.load_validator(self.filepath, 'codegen')
+        validator.validate({'name': 'granule'})
+        with self.assertRaises(ValidationError):
+            validator.validate({'name': 1})
+        assert os.listdir(self.folder) == ['input.json']
+
+    def test_unknown_engines_raise(self):
+        """ CMA_SCHEMA_VALIDATOR must name an engine """
+        with patch.dict(os.environ, {schemas.ENGINE_ENV_VAR: 'fast'}):
+            with self.assertRaises(LookupError):
+                schemas.load_validator(self.filepath)
+
+    def test_schema_exists_is_cached(self):
+        """ The existence of schema files is probed once """
+        missing = os.path.join(self.folder, 'output.json')
+        assert schemas.schema_exists(self.filepath)
+        assert not schemas.schema_exists(missing)
+        os.remove(self.filepath)
+        assert schemas.schema_exists(self.filepath)
+        schemas.cache_clear()
+        assert not schemas.schema_exists(self.filepath)
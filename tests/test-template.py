@@ -0,0 +1,90 @@
+"""
+Tests for message_adapter compiled templates
+"""
+import unittest
+
+from copy import deepcopy
+from message_adapter import jsonpath, template
+
+
+class Test(unittest.TestCase):
+    """ Test class """
+    event = {
+        'meta': {'foo': 'bar', 'collection': {'name': 'MOD09GQ', 'version': '006'}},
+        'payload': {'granules': [{'granuleId': 'g1'}, {'granuleId': 'g2'}]}
+    }
+
+    def setUp(self):
+        template.cache_clear()
+
+    def test_template_flavors(self):
+        """ Value, array, inline and plain strings resolve like resolve_path_str """
+        cases = [
+            ('{$.meta.foo}', 'bar'),
+            ('{{$.meta.collection}}', {'name': 'MOD09GQ', 'version': '006'}),
+            ('{$.meta.missing}', None),
+            ('{[$.meta.foo]}', ['bar']),
+            ('{[$.meta.missing]}', []),
+            ('prefix{meta.foo}suffix', 'prefixbarsuffix'),
+            ('v{$.meta.collection.name}___{$.meta.collection.version}', 'vMOD09GQ___006'),
+            ('keep {$.meta.missing} as is', 'keep {$.meta.missing} as is'),
+            ('no template', 'no template'),
+        ]
+        for json_path_string, expected in cases:
+            compiled = template.compile_template(json_path_string)
+            result = compiled.resolve(self.event) if compiled else json_path_string
+            self.assertEqual(result, expected, json_path_string)
+
+    def test_config_plan_resolves_config(self):
+        """ A compiled plan resolves every template of a configuration """
+        config = {
+            'provider': 'static',
+            'collection': '{$.meta.collection.name}',
+            'granuleIds': ['{$.payload.granules[0].granuleId}', 'fixed', 3],
+            'nested': {'inline': 'v{$.meta.collection.version}', 'flag': True},
+        }
+        original = deepcopy(config)
+        result = template.compile_config(config).resolve(self.event, config)
+        self.assertEqual(result, {
+            'provider': 'static',
+            'collection': 'MOD09GQ',
+            'granuleIds': ['g1', 'fixed', 3],
+            'nested': {'inline': 'v006', 'flag': True},
+        })
+        self.assertEqual(config, original)
+
+    def test_constant_subtrees_are_not_rebuilt(self):
+        """ Subtrees without templates are returned as they are """
+        config = {'constant': {'a': [1, 2, {'b': 'c'}]}, 'templated': '{$.meta.foo}'}
+        result = template.compile_config(config).resolve(self.event, config)
+        assert result['constant'] is config['constant']
+        assert result['templated'] == 'bar'
+
+    def test_plans_are_cached_by_fingerprint(self):
+        """ Equal configurations share one plan, whatever their key order """
+        first = template.compile_config({'a': '{$.meta.foo}', 'b': 'x'})
+        second = template.compile_config({'b': 'x', 'a': '{$.meta.foo}'})
+        assert first is second
+        info = template.cache_info()
+        assert (info.hits, info.misses) == (1, 1)
+        config = {'b': 'x', 'a': '{$.meta.foo}'}
+        assert list(second.resolve(self.event, config)) == ['b', 'a']
+
+    def test_path_set_matches_individual_finds(self):
+        """ A PathSet resolves each of its paths as path.find would """
+        paths = [jsonpath.compile_path(path) for path in (
+            '$', '$.meta', '$.meta.foo', 'meta.foo', '$.meta.collection.name',
+            '$.meta.missing', '$.meta.foo.deeper', '$.payload.granules[1].granuleId',
+            '$.payload.granules[5]', '$.payload.granules[0].missing')]
+        found = jsonpath.PathSet(paths).find(self.event)
+        for path in paths:
+            self.assertEqual(found.get(path, []), path.find(self.event), str(path))
+
+    def test_config_and_input_resolve_together(self):
+        """ The input template is resolved with the configuration templates """
+        config = {'collection': '{$.meta.collection.name}', 'provider': 'static'}
+        plan = template.compile_config(config, '{$.payload.granules[0]}')
+        assert plan.resolve_with_input(self.event, config, '{$.payload.granules[0]}') == \
+            ({'collection': 'MOD09GQ', 'provider': 'static'}, {'granuleId': 'g1'})
+        assert template.compile_config(config, '{$.payload.granules[0]}') is plan
+        assert template.compile_config(config) is not plan
@@ -0,0 +1,119 @@
+"""
+Tests for message_adapter S3 transfers, against the local S3 stand-in
+"""
+import hashlib
+import os
+import unittest
+
+from datetime import timedelta
+
+from botocore.exceptions import ClientError
+from mock import patch
+from message_adapter import aws, codec, cumulus_message, transfer
+
+MIB = 1024 * 1024
+
+
+class Test(unittest.TestCase):
+    """ Test class """
+    bucket_name = 'testing-transfer'
+
+    def setUp(self):
+        self.bucket = aws.s3().Bucket(self.bucket_name)
+        self.bucket.create()
+
+    def tearDown(self):
+        self.bucket.objects.all().delete()
+        self.bucket.delete()
+
+    def test_small_bodies_are_put_whole(self):
+        """ Bodies under the threshold are written in one request """
+        s3_object = self.bucket.Object('events/small')
+        transfer.put_object(s3_object, b'{"a": 1}', ContentEncoding='identity')
+        data = s3_object.get()
+        assert data['Body'].read() == b'{"a": 1}'
+        assert data['ContentEncoding'] == 'identity'
+        assert '-' not in data['ETag']
+
+    def test_large_bodies_are_uploaded_in_parts(self):
+        """ Bodies over the threshold are uploaded in parallel parts of the configured size """
+        body = b'[' + b','.join([b'"granule"'] * (12 * MIB // 10)) + b']'
+        s3_object = self.bucket.Object('events/large')
+        with patch.dict(os.environ, {transfer.MULTIPART_THRESHOLD_ENV_VAR: str(MIB),
+                                     transfer.PART_SIZE_ENV_VAR: str(5 * MIB),
+                                     transfer.CONCURRENCY_ENV_VAR: '3'}):
+            transfer.put_object(s3_object, body, ContentEncoding='identity')
+        data = s3_object.get()
+        assert data['Body'].read() == body
+        assert data['ContentEncoding'] == 'identity'
+        # the ETag of a multipart upload ends with its number of parts
+        assert data['ETag'].strip('"').endswith('-3')
+
+    def test_large_objects_are_downloaded_in_ranges(self):
+        """ Objects over the threshold are read into one buffer with parallel ranged GETs """
+        body = b'{"granules": [' + b','.join([b'"granule"'] * (12 * MIB // 10)) + b']}'
+        self.bucket.Object('events/large').put(Body=body)
+        client = aws.s3().meta.client
+        with patch.dict(os.environ, {transfer.RANGED_GET_THRESHOLD_ENV_VAR: str(MIB),
+                                     transfer.PART_SIZE_ENV_VAR: str(5 * MIB)}):
+            with patch.object(client, 'get_object', wraps=client.get_object) as get_object:
+                data = transfer.get_object(self.bucket.Object('events/large'))
+                assert isinstance(data['Body'], transfer.BufferReader)
+                assert data['Body'].data == body
+                # the first part is read from the plain GET
+                assert [call[1].get('Range') for call in get_object.call_args_list] == \
+                    [None, f'bytes={5 * MIB}-{10 * MIB - 1}', f'bytes={10 * MIB}-{len(body) - 1}']
+                event = {'replace': {'Bucket': self.bucket_name, 'Key': 'events/large',
+                                     'TargetPath': '$.payload'}, 'payload': {}}
+                with patch.object(codec, '_build', wraps=codec._build) as build:
+                    remote_event = cumulus_message.load_remote_event(event)
+        assert remote_event == {'payload': {'granules': ['granule'] * (12 * MIB // 10)}}
+        # the downloaded buffer is parsed in chunks, without a str copy of the document
+        assert build.called == codec.streams(len(body))
+
+    def test_small_objects_are_read_with_one_get(self):
+        """ Objects under the threshold are streamed from a single GET """
+        self.bucket.Object('events/small').put(Body=b'{"a": 1}')
+        data = transfer.get_object(self.bucket.Object('events/small'))
+        assert not isinstance(data['Body'], transfer.BufferReader)
+        assert data['Body'].read() == b'{"a": 1}'
+
+    def test_buffer_reader(self):
+        """ BufferReader reads its data as a binary stream """
+        reader = transfer.BufferReader(bytearray(b'0123456789'))
+        assert reader.read(4) == b'0123'
+        assert reader.read() == b'456789'
+        assert reader.read(1) == b''
+
+    def test_content_addressed_objects_are_written_once(self):
+        """ put_object_once skips the upload when the content addressed object exists """
+        body = b'{"granules": []}'
+        key = transfer.content_key(body, 'gzip')
+        assert key == f'events/sha256-{hashlib.sha256(body).hexdigest()}.gzip'
+        s3_object = self.bucket.Object(key)
+        assert transfer.put_object_once(s3_object, body, ContentEncoding='identity')
+        last_modified = s3_object.get()['LastModified']
+        with patch.object(transfer, 'put_object') as put_object:
+            assert not transfer.put_object_once(s3_object, body, ContentEncoding='identity')
+        put_object.assert_not_called()
+        assert s3_object.get()['LastModified'] == last_modified
+
+    def test_content_addressed_objects_are_written_when_head_is_forbidden(self):
+        """ Without s3:ListBucket a missing object answers 403, it is written all the same """
+        s3_object = self.bucket.Object(transfer.content_key(b'{}'))
+        forbidden = ClientError({'Error': {'Code': '403', 'Message': 'Forbidden'},
+                                 'ResponseMetadata': {'HTTPStatusCode': 403}}, 'HeadObject')
+        with patch.object(s3_object.meta.client, 'head_object', side_effect=forbidden):
+            assert transfer.put_object_once(s3_object, b'{}', ContentEncoding='identity')
+        assert s3_object.get()['Body'].read() == b'{}'
+
+    def test_old_content_addressed_objects_are_renewed(self):
+        """ Existing objects past the refresh age are copied onto themselves """
+        s3_object = self.bucket.Object(transfer.content_key(b'{}'))
+        transfer.put_object_once(s3_object, b'{}', ContentEncoding='identity')
+        with patch.object(transfer, 'CONTENT_ADDRESSED_REFRESH_AGE', timedelta(seconds=-60)):
+            with patch.object(s3_object, 'copy_from') as copy_from:
+                assert not transfer.put_object_once(s3_object, b'{}', ContentEncoding='identity')
+        copy_from.assert_called_once_with(
+            CopySource={'Bucket': self.bucket_name, 'Key': s3_object.key},
+            MetadataDirective='REPLACE', ContentEncoding='identity')